@@ -17,8 +17,10 @@ echo.
 echo Step 3: Installing core dependencies...
 pip install fastapi==0.104.1
 pip install uvicorn==0.24.0
+pip install httptools==0.6.1
 pip install python-multipart==0.0.6
 pip install pydantic==2.5.0
+pip install pydantic-settings==2.1.0
 
 REM Install OpenAI
 echo.
@@ -39,7 +41,10 @@ echo Step 6: Installing other dependencies...
 pip install aiofiles==23.2.1
 pip install websockets==12.0
 pip install httpx==0.25.2
+pip install redis==5.0.1
 pip install python-dotenv==1.0.0
+pip install orjson==3.9.10
+pip install diskcache==5.6.3
 pip install numpy==1.24.3
 pip install tqdm==4.66.1
 pip install tiktoken==0.5.2
@@ -4,23 +4,28 @@ Main application server with FastAPI
 """
 
 import os
+import asyncio
 import logging
+import multiprocessing
+import tempfile
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import Optional
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from dotenv import load_dotenv
 import uvicorn
+import aiofiles
 
-from src.video_processor import VideoProcessor
+from src.video_processor import init_worker, stream_frames_in_worker, aiter_frame_queue
 from src.event_recognizer import EventRecognizer
 from src.chat_handler import ChatHandler
-from src.conversation_manager import ConversationManager
-
-# Load environment variables
-load_dotenv()
+from src.conversation_manager import ConversationManager, serialize_session, serialize_messages
+from src.session_store import InMemorySessionStore, RedisSessionStore
+from src.config import get_settings
 
 # Configure logging
 logging.basicConfig(
@@ -29,11 +34,29 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+settings = get_settings()
+
+# Workers only share sessions through Redis, so default to one without it
+SERVER_WORKERS = settings.workers or (os.cpu_count() if settings.redis_url else 1)
+
+# Extraction processes share the CPUs with the other server workers
+VIDEO_WORKERS = settings.video_workers or max(1, (os.cpu_count() or 1) // SERVER_WORKERS)
+
+# Uploaded videos are stored here while being analyzed
+TEMP_DIR = "temp"
+
+# Uploads are copied to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Interval between sweeps of expired sessions
+SESSION_SWEEP_INTERVAL_SECONDS = 60
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Visual Understanding Chat Assistant",
     description="An AI-powered assistant for video analysis and conversation",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS configuration
@@ -46,9 +69,52 @@ app.add_middleware(
 )
 
 # Initialize components
-video_processor = VideoProcessor()
 event_recognizer = EventRecognizer()
-conversation_manager = ConversationManager()
+
+def create_video_executor() -> ProcessPoolExecutor:
+    """Start the processes frames are extracted in"""
+    return ProcessPoolExecutor(
+        max_workers=VIDEO_WORKERS,
+        initializer=partial(
+            init_worker, fmt=settings.frame_format, thumbnails=settings.vlm_keyframe_deltas,
+            dedup=settings.frame_dedup_distance >= 0
+        )
+    )
+
+# Frame extraction is CPU-bound, so it runs in separate processes
+video_executor = create_video_executor()
+
+def start_extraction(video_path: str, frame_queue) -> asyncio.Future:
+    """
+    Stream frames from a video into a queue in an extraction process,
+    replacing the pool if a crashed process left it broken
+    
+    Args:
+        video_path: Path to video file
+        frame_queue: Shared queue receiving frame data, then None when done
+        
+    Returns:
+        Future completing when extraction finishes
+    """
+    global video_executor
+    loop = asyncio.get_running_loop()
+    try:
+        return loop.run_in_executor(
+            video_executor, stream_frames_in_worker, video_path, frame_queue
+        )
+    except BrokenProcessPool:
+        logger.warning("Frame extraction pool is broken, restarting it")
+        video_executor.shutdown(wait=False, cancel_futures=True)
+        video_executor = create_video_executor()
+        return loop.run_in_executor(
+            video_executor, stream_frames_in_worker, video_path, frame_queue
+        )
+
+# Share sessions across workers through Redis when configured
+session_store = (
+    RedisSessionStore(settings.redis_url) if settings.redis_url else InMemorySessionStore()
+)
+conversation_manager = ConversationManager(store=session_store)
 chat_handler = ChatHandler(conversation_manager)
 
 # Request/Response models
@@ -81,41 +147,48 @@ async def upload_video(
     """
     Upload and analyze a video file
     """
+    temp_path = None
     try:
         # Validate video file
         if not file.filename.endswith(('.mp4', '.avi', '.mov', '.mkv', '.webm')):
             raise HTTPException(status_code=400, detail="Invalid video format")
         
-        # Save uploaded video temporarily
-        temp_path = f"temp/{file.filename}"
-        os.makedirs("temp", exist_ok=True)
+        # Save uploaded video temporarily under a unique name
+        suffix = os.path.splitext(file.filename)[1]
+        with tempfile.NamedTemporaryFile(delete=False, dir=TEMP_DIR, suffix=suffix) as temp_file:
+            temp_path = temp_file.name
         
-        with open(temp_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        # Stream to disk so memory use does not grow with video size
+        await file.seek(0)
+        async with aiofiles.open(temp_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                await buffer.write(chunk)
         
         # Process video
         logger.info(f"Processing video: {file.filename}")
-        frames = video_processor.extract_frames(temp_path)
+        # Blocking work runs off the event loop so chat requests keep being served
+        # Frames stream back from the worker so VLM requests start while decoding continues
+        frame_queue = app.state.frame_queues.Queue()
+        extraction = start_extraction(temp_path, frame_queue)
         
-        # Recognize events
-        events = event_recognizer.detect_events(frames)
+        # Recognize events; batches are sent to the VLM concurrently
+        events = await event_recognizer.detect_events(aiter_frame_queue(frame_queue, extraction))
+        
+        # Surface extraction errors
+        await extraction
         
         # Generate summary and check guideline adherence
-        summary, guidelines = event_recognizer.generate_summary(events)
+        summary, guidelines = await event_recognizer.generate_summary(events)
         
         # Create or update session
         if not session_id:
-            session_id = conversation_manager.create_session()
+            session_id = await conversation_manager.create_session()
         
         # Store video analysis in session
-        conversation_manager.store_video_analysis(
+        await conversation_manager.store_video_analysis(
             session_id, events, summary, guidelines
         )
         
-        # Clean up temp file
-        os.remove(temp_path)
-        
         return VideoAnalysisResponse(
             session_id=session_id,
             events=events,
@@ -126,6 +199,11 @@ async def upload_video(
     except Exception as e:
         logger.error(f"Error processing video: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+    
+    finally:
+        # Clean up temp file
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
 
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat(message: ChatMessage):
@@ -134,7 +212,7 @@ async def chat(message: ChatMessage):
     """
     try:
         # Get or create session
-        session_id = message.session_id or conversation_manager.create_session()
+        session_id = message.session_id or await conversation_manager.create_session()
         
         # Process message with context
         response = await chat_handler.process_message(
@@ -155,35 +233,91 @@ async def chat(message: ChatMessage):
 @app.get("/api/session/{session_id}")
 async def get_session(session_id: str):
     """
-    Retrieve session information
+    Retrieve session information (conversation history is served separately)
     """
     try:
-        session_data = conversation_manager.get_session(session_id)
+        session_data = await conversation_manager.get_session(session_id)
         if not session_data:
             raise HTTPException(status_code=404, detail="Session not found")
-        return session_data
+        # Returning the response directly skips FastAPI's jsonable_encoder pass
+        return ORJSONResponse(serialize_session(session_data, include_history=False))
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error retrieving session: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/session/{session_id}/history")
+async def get_session_history(session_id: str, limit: Optional[int] = Query(None, ge=1)):
+    """
+    Retrieve conversation history, optionally only the last `limit` messages
+    """
+    try:
+        session_data = await conversation_manager.get_session(session_id)
+        if not session_data:
+            raise HTTPException(status_code=404, detail="Session not found")
+        
+        history = session_data['conversation_history']
+        if limit:
+            history = history[-limit:]
+        
+        return ORJSONResponse({
+            'session_id': session_id,
+            'system_messages': serialize_messages(session_data.get('system_messages', [])),
+            'conversation_history': serialize_messages(history)
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error retrieving session history: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.delete("/api/session/{session_id}")
 async def clear_session(session_id: str):
     """
     Clear a conversation session
     """
     try:
-        conversation_manager.clear_session(session_id)
+        await conversation_manager.clear_session(session_id)
         return {"message": "Session cleared successfully"}
     except Exception as e:
         logger.error(f"Error clearing session: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def sweep_expired_sessions():
+    """Periodically evict expired sessions"""
+    while True:
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL_SECONDS)
+        try:
+            await conversation_manager.clear_expired_sessions()
+        except Exception as e:
+            logger.error(f"Error clearing expired sessions: {str(e)}")
+
+@app.on_event("startup")
+async def startup():
+    """Prepare the temp directory and start background tasks"""
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    # Serves the queues that stream frames back from the extraction processes
+    app.state.frame_queues = multiprocessing.Manager()
+    app.state.session_sweeper = asyncio.create_task(sweep_expired_sessions())
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Stop background tasks and release external connections"""
+    app.state.session_sweeper.cancel()
+    video_executor.shutdown(wait=False, cancel_futures=True)
+    app.state.frame_queues.shutdown()
+    await chat_handler.aclose()
+    await event_recognizer.aclose()
+    await conversation_manager.aclose()
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 if __name__ == "__main__":
-    host = os.getenv("HOST", "0.0.0.0")
-    port = int(os.getenv("PORT", 8000))
-    
-    logger.info(f"Starting server on {host}:{port}")
-    uvicorn.run("main:app", host=host, port=port, reload=False)
+    logger.info(f"Starting server on {settings.host}:{settings.port} with {SERVER_WORKERS} worker(s)")
+    # "auto" selects uvloop and httptools when they are installed
+    uvicorn.run(
+        "main:app", host=settings.host, port=settings.port, reload=False,
+        loop="auto", http="auto", workers=SERVER_WORKERS
+    )
@@ -0,0 +1,51 @@
+"""
+Near-Duplicate Detection Kernels
+dHash computation, JIT-compiled with Numba when it is installed
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # Numba is optional; NumPy computes the same hashes
+    njit = None
+
+def _dhash_batch_numpy(gray: np.ndarray) -> np.ndarray:
+    """
+    Compute 64-bit difference hashes with NumPy
+    
+    Args:
+        gray: (N, 8, 9) uint8 grayscale thumbnails
+        
+    Returns:
+        (N,) uint64 hashes
+    """
+    # One bit per horizontally adjacent pixel pair, most significant bit first
+    bits = gray[:, :, 1:] > gray[:, :, :-1]
+    packed = np.packbits(bits.reshape(len(gray), 64), axis=1)
+    return packed.view('>u8').ravel().astype(np.uint64)
+
+if njit is not None:
+    # Frames are hashed from several encoder threads at once, so the kernel
+    # releases the GIL instead of starting its own (non-reentrant) thread pool
+    @njit(nogil=True, cache=True)
+    def dhash_batch(gray: np.ndarray) -> np.ndarray:
+        """
+        Compute 64-bit difference hashes
+        
+        Args:
+            gray: (N, 8, 9) uint8 grayscale thumbnails
+            
+        Returns:
+            (N,) uint64 hashes, bit-identical to the NumPy fallback
+        """
+        hashes = np.zeros(gray.shape[0], dtype=np.uint64)
+        for n in range(gray.shape[0]):
+            h = np.uint64(0)
+            for row in range(8):
+                for col in range(8):
+                    h = (h << np.uint64(1)) | np.uint64(gray[n, row, col + 1] > gray[n, row, col])
+            hashes[n] = h
+        return hashes
+else:
+    dhash_batch = _dhash_batch_numpy
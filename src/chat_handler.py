@@ -3,18 +3,56 @@ Chat Handler Module
 Handles multi-turn conversations with context retention
 """
 
-import os
+import re
+import heapq
 import logging
-from typing import List, Dict, Any, Optional
+from itertools import islice
+from bisect import bisect_left, bisect_right
+from typing import List, Dict, Any, Optional, Tuple, ClassVar, FrozenSet, Pattern
 from datetime import datetime
-from openai import OpenAI
+from openai import AsyncOpenAI
+import httpx
 import json
 
+from src.conversation_manager import render_analysis_context, session_history
+from src.config import get_settings
+
 logger = logging.getLogger(__name__)
 
+def _compile_keywords(keywords: Dict[str, FrozenSet[str]]) -> Tuple[Dict[str, str], Pattern]:
+    """
+    Build a word -> topic map and a single regex matching every keyword
+    
+    Longer words are tried first so a keyword contained in another
+    (e.g. 'time' in 'timestamp') resolves to the longer one.
+    """
+    word_to_topic = {word: topic for topic, words in keywords.items() for word in words}
+    pattern = re.compile('|'.join(
+        re.escape(word) for word in sorted(word_to_topic, key=len, reverse=True)
+    ))
+    return word_to_topic, pattern
+
 class ChatHandler:
     """Handles multi-turn conversations using Nebius AI models"""
     
+    # Keywords used to tag the current topics of a conversation
+    _TOPIC_KEYWORDS: ClassVar[Dict[str, FrozenSet[str]]] = {
+        'traffic': frozenset({'traffic', 'vehicle', 'car', 'pedestrian', 'light', 'road'}),
+        'safety': frozenset({'safety', 'violation', 'danger', 'hazard', 'risk'}),
+        'timeline': frozenset({'when', 'time', 'timestamp', 'sequence', 'order'}),
+        'summary': frozenset({'summary', 'overview', 'summarize', 'brief'})
+    }
+    _WORD2TOPIC, _KEYWORD_RE = _compile_keywords(_TOPIC_KEYWORDS)
+    
+    # Keywords used to label topics in conversation summaries
+    _SUMMARY_KEYWORDS: ClassVar[Dict[str, FrozenSet[str]]] = {
+        'events': frozenset({'event'}),
+        'violations': frozenset({'violation', 'guideline'}),
+        'summary': frozenset({'summary'}),
+        'timeline': frozenset({'time', 'when'})
+    }
+    _SUMMARY_WORD2TOPIC, _SUMMARY_KEYWORD_RE = _compile_keywords(_SUMMARY_KEYWORDS)
+    
     def __init__(self, conversation_manager):
         """
         Initialize chat handler with Nebius AI Gemma-3-27B
@@ -23,11 +61,16 @@ class ChatHandler:
             conversation_manager: ConversationManager instance
         """
         self.conversation_manager = conversation_manager
-        
-        # Use Nebius AI Studio with OpenAI-compatible API
-        self.client = OpenAI(
-            base_url="https://api.studio.nebius.com/v1/",
-            api_key=os.getenv("NEBIUS_API_KEY")
+        settings = get_settings()
+        
+        # Use Nebius AI Studio with OpenAI-compatible API over a pooled async client
+        self.client = AsyncOpenAI(
+            base_url=settings.nebius_base_url,
+            api_key=settings.nebius_api_key,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
+                timeout=30
+            )
         )
         
         # Use Google Gemma-3-27B for chat interactions
@@ -60,12 +103,16 @@ class ChatHandler:
         """
         try:
             # Add user message to history
-            self.conversation_manager.add_message(session_id, 'user', message)
+            await self.conversation_manager.add_message(session_id, 'user', message)
             
-            # Get conversation context
-            history = self.conversation_manager.get_conversation_history(session_id, limit=10)
-            video_analysis = self.conversation_manager.get_video_analysis(session_id)
-            context = self.conversation_manager.get_context(session_id)
+            # Get conversation context from a single read of the session
+            session = await self.conversation_manager.get_session(session_id)
+            if session:
+                history = session_history(session, limit=10)
+                video_analysis = session.get('video_analysis')
+                context = session.get('context', {})
+            else:
+                history, video_analysis, context = [], None, {}
             
             # Build messages for LLM
             messages = self._build_messages(history, video_analysis, context, message)
@@ -74,10 +121,10 @@ class ChatHandler:
             response = await self._generate_response(messages)
             
             # Add assistant response to history
-            self.conversation_manager.add_message(session_id, 'assistant', response)
+            await self.conversation_manager.add_message(session_id, 'assistant', response)
             
             # Update context if needed
-            self._update_context_from_conversation(session_id, message, response)
+            await self._update_context_from_conversation(session_id, message, response)
             
             return response
             
@@ -104,22 +151,12 @@ class ChatHandler:
         # Add system prompt
         system_content = self.system_prompt
         
-        # Add video analysis context if available
+        # Add video analysis context if available, rendered at analysis time
         if video_analysis:
-            system_content += f"\n\nVideo Analysis Available:\n"
-            system_content += f"Summary: {video_analysis.get('summary', 'No summary available')}\n"
-            system_content += f"Total Events: {len(video_analysis.get('events', []))}\n"
-            
-            guidelines = video_analysis.get('guidelines', {})
-            system_content += f"Guideline Compliance: {guidelines.get('compliance_status', 'Unknown')}\n"
-            system_content += f"Violations: {guidelines.get('violations_count', 0)}\n"
-            
-            # Add recent events for context
-            events = video_analysis.get('events', [])[:5]  # First 5 events
-            if events:
-                system_content += "\nSample Events:\n"
-                for event in events:
-                    system_content += f"- [{event.get('timestamp', 0):.1f}s] {event.get('description', 'No description')}\n"
+            analysis_context = video_analysis.get('_system_prompt_cache')
+            if analysis_context is None:
+                analysis_context = render_analysis_context(video_analysis)
+            system_content += analysis_context
         
         messages.append({"role": "system", "content": system_content})
         
@@ -147,7 +184,7 @@ class ChatHandler:
             Generated response
         """
         try:
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=self.model,
                 messages=messages,
                 max_tokens=500,
@@ -161,7 +198,13 @@ class ChatHandler:
             logger.error(f"Error generating response: {str(e)}")
             raise
     
-    def _update_context_from_conversation(self, session_id: str, message: str, response: str):
+    async def aclose(self):
+        """
+        Close the pooled HTTP connections to the LLM endpoint
+        """
+        await self.client.close()
+    
+    async def _update_context_from_conversation(self, session_id: str, message: str, response: str):
         """
         Update session context based on conversation
         
@@ -170,23 +213,16 @@ class ChatHandler:
             message: User message
             response: Assistant response
         """
-        # Detect if user is asking about specific topics
-        topics = []
-        
-        keywords = {
-            'traffic': ['traffic', 'vehicle', 'car', 'pedestrian', 'light', 'road'],
-            'safety': ['safety', 'violation', 'danger', 'hazard', 'risk'],
-            'timeline': ['when', 'time', 'timestamp', 'sequence', 'order'],
-            'summary': ['summary', 'overview', 'summarize', 'brief']
+        # Detect if user is asking about specific topics in a single scan
+        matched = {
+            self._WORD2TOPIC[word]
+            for word in self._KEYWORD_RE.findall(message.lower())
         }
-        
-        message_lower = message.lower()
-        for topic, words in keywords.items():
-            if any(word in message_lower for word in words):
-                topics.append(topic)
+        # Keep the declared topic order
+        topics = [topic for topic in self._TOPIC_KEYWORDS if topic in matched]
         
         if topics:
-            self.conversation_manager.update_context(session_id, 'current_topics', topics)
+            await self.conversation_manager.update_context(session_id, 'current_topics', topics)
     
     async def answer_specific_query(self, session_id: str, query_type: str, 
                                    parameters: Dict) -> str:
@@ -201,7 +237,7 @@ class ChatHandler:
         Returns:
             Specific answer
         """
-        video_analysis = self.conversation_manager.get_video_analysis(session_id)
+        video_analysis = await self.conversation_manager.get_video_analysis(session_id)
         
         if not video_analysis:
             return "No video has been analyzed yet. Please upload a video first."
@@ -211,11 +247,13 @@ class ChatHandler:
         
         if query_type == 'event_at_time':
             timestamp = parameters.get('timestamp', 0)
-            # Find events near this timestamp
-            nearby_events = [
-                e for e in events 
-                if abs(e.get('timestamp', 0) - timestamp) < 2.0
-            ]
+            # Find events strictly within 2s of this timestamp; events are sorted by time
+            timestamps = video_analysis.get('_timestamps')
+            if timestamps is None:
+                timestamps = [e.get('timestamp', 0) for e in events]
+            lo = bisect_right(timestamps, timestamp - 2.0)
+            hi = bisect_left(timestamps, timestamp + 2.0)
+            nearby_events = events[lo:hi]
             
             if nearby_events:
                 response = f"Events around {timestamp}s:\n"
@@ -237,22 +275,35 @@ class ChatHandler:
         
         elif query_type == 'event_summary':
             event_type = parameters.get('event_type', '')
-            filtered_events = [
-                e for e in events 
-                if event_type.lower() in e.get('event_type', '').lower()
-            ]
+            needle = event_type.lower()
+            index = video_analysis.get('_event_type_index')
+            if index is None:
+                matching_positions = [[
+                    i for i, e in enumerate(events)
+                    if needle in (e.get('event_type') or '').lower()
+                ]]
+            else:
+                # Substring-match the few distinct types; each position list is in time order
+                matching_positions = [
+                    positions for key, positions in index.items() if needle in key
+                ]
             
-            if filtered_events:
-                response = f"Found {len(filtered_events)} {event_type} events:\n"
-                for event in filtered_events[:5]:  # Limit to 5
-                    response += f"- [{event.get('timestamp', 0):.1f}s] {event.get('description', 'No description')}\n"
-                return response
+            match_count = sum(len(positions) for positions in matching_positions)
+            if match_count:
+                # Merge lazily so only the events shown are visited
+                shown = islice(heapq.merge(*matching_positions), 5)  # Limit to 5
+                lines = [f"Found {match_count} {event_type} events:\n"]
+                lines.extend(
+                    f"- [{events[i].get('timestamp', 0):.1f}s] {events[i].get('description', 'No description')}\n"
+                    for i in shown
+                )
+                return "".join(lines)
             else:
                 return f"No {event_type} events found in the video."
         
         return "Query type not recognized."
     
-    def get_conversation_summary(self, session_id: str) -> str:
+    async def get_conversation_summary(self, session_id: str) -> str:
         """
         Generate a summary of the conversation
         
@@ -262,7 +313,7 @@ class ChatHandler:
         Returns:
             Conversation summary
         """
-        history = self.conversation_manager.get_conversation_history(session_id)
+        history = await self.conversation_manager.get_conversation_history(session_id)
         
         if not history:
             return "No conversation history available."
@@ -277,15 +328,10 @@ class ChatHandler:
         # Identify topics
         topics = set()
         for q in user_questions:
-            q_lower = q.lower()
-            if 'event' in q_lower:
-                topics.add('events')
-            if 'violation' in q_lower or 'guideline' in q_lower:
-                topics.add('violations')
-            if 'summary' in q_lower:
-                topics.add('summary')
-            if 'time' in q_lower or 'when' in q_lower:
-                topics.add('timeline')
+            topics.update(
+                self._SUMMARY_WORD2TOPIC[word]
+                for word in self._SUMMARY_KEYWORD_RE.findall(q.lower())
+            )
         
         summary += ", ".join(topics) if topics else "general"
         
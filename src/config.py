@@ -0,0 +1,59 @@
+"""
+Configuration Module
+Application settings parsed once from the environment and .env
+"""
+
+from functools import lru_cache
+from typing import Optional
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+class Settings(BaseSettings):
+    """Application settings read from environment variables"""
+
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
+
+    # Nebius AI Studio
+    nebius_api_key: Optional[str] = None
+    nebius_base_url: str = "https://api.studio.nebius.com/v1/"
+
+    # Vision model request fan-out (0 tokens per minute means unlimited)
+    vlm_max_concurrent: int = 10
+    vlm_tokens_per_minute: int = 0
+    # Frame batches combined into one request (raise when requests per minute are limited)
+    vlm_batches_per_request: int = 1
+    # Request json_object responses (only if the endpoint supports response_format)
+    vlm_json_mode: bool = False
+    # Send one full-resolution key frame per batch and thumbnails for the rest
+    vlm_keyframe_deltas: bool = False
+
+    # Per-frame event cache (disabled when empty) and near-duplicate frame
+    # threshold in dHash bits (-1 disables; skipped frames contribute no events)
+    event_cache_dir: str = "~/.cache/visual-chat-assistant/events"
+    frame_dedup_distance: int = -1
+
+    # Image format frames are sent in ('webp' or 'jpeg')
+    frame_format: str = "webp"
+
+    # Base URL frames are PUT to and referenced from (sent inline when unset)
+    frame_store_url: Optional[str] = None
+
+    # Server
+    host: str = "0.0.0.0"
+    port: int = 8000
+    workers: Optional[int] = None
+    # Frame extraction processes per server worker (defaults to the CPU count
+    # divided between server workers)
+    video_workers: Optional[int] = None
+
+    # Session storage (in-memory when unset)
+    redis_url: Optional[str] = None
+
+@lru_cache
+def get_settings() -> Settings:
+    """
+    Get application settings, parsing the environment on first use
+
+    Returns:
+        Settings instance
+    """
+    return Settings()
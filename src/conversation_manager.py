@@ -3,28 +3,128 @@ Conversation Manager Module
 Manages conversation sessions and context retention
 """
 
+import time
 import uuid
 import logging
+from collections import defaultdict
 from typing import Dict, List, Optional, Any
-from datetime import datetime, timedelta
-import json
+from datetime import datetime
+import orjson
+
+from src.session_store import SessionStore, InMemorySessionStore
 
 logger = logging.getLogger(__name__)
 
+def _ns_to_iso(timestamp_ns: int) -> str:
+    """Format a time.time_ns() value as a local ISO timestamp"""
+    return datetime.fromtimestamp(timestamp_ns / 1e9).isoformat()
+
+def serialize_messages(messages: List[Dict]) -> List[Dict]:
+    """
+    Convert stored messages to their external form with ISO timestamps
+    
+    Args:
+        messages: Messages as kept in the store
+        
+    Returns:
+        JSON-ready list of messages
+    """
+    return [{**m, 'timestamp': _ns_to_iso(m['timestamp'])} for m in messages]
+
+def serialize_session(session: Dict, include_history: bool = True) -> Dict:
+    """
+    Convert stored session data to its external form with ISO timestamps
+    
+    Args:
+        session: Session data as kept in the store
+        include_history: Whether to include conversation and system messages
+        
+    Returns:
+        JSON-ready session dictionary
+    """
+    video_analysis = session['video_analysis']
+    if video_analysis:
+        # Drop internal lookup structures and caches
+        video_analysis = {k: v for k, v in video_analysis.items() if not k.startswith('_')}
+    
+    data = {
+        'id': session['id'],
+        'created_at': datetime.fromtimestamp(session['created_at']).isoformat(),
+        'last_activity': datetime.fromtimestamp(session['last_activity']).isoformat(),
+        'video_analysis': video_analysis,
+        'context': session['context']
+    }
+    
+    if include_history:
+        data['conversation_history'] = serialize_messages(session['conversation_history'])
+        data['system_messages'] = serialize_messages(session.get('system_messages', []))
+    
+    return data
+
+def session_history(session: Dict, limit: int = None) -> List[Dict]:
+    """
+    Get a session's system messages followed by its conversation history
+    
+    Args:
+        session: Session data as kept in the store
+        limit: Maximum number of messages to return
+        
+    Returns:
+        List of messages
+    """
+    history = session.get('system_messages', []) + session['conversation_history']
+    
+    if limit:
+        return history[-limit:]
+    
+    return history
+
+def render_analysis_context(video_analysis: Dict) -> str:
+    """
+    Render the video analysis section appended to the chat system prompt
+    
+    Args:
+        video_analysis: Video analysis data
+        
+    Returns:
+        Prompt text describing the analysis
+    """
+    guidelines = video_analysis.get('guidelines', {})
+    parts = [
+        "\n\nVideo Analysis Available:\n",
+        f"Summary: {video_analysis.get('summary', 'No summary available')}\n",
+        f"Total Events: {len(video_analysis.get('events', []))}\n",
+        f"Guideline Compliance: {guidelines.get('compliance_status', 'Unknown')}\n",
+        f"Violations: {guidelines.get('violations_count', 0)}\n"
+    ]
+    
+    # Add recent events for context
+    events = video_analysis.get('events', [])[:5]  # First 5 events
+    if events:
+        parts.append("\nSample Events:\n")
+        parts.extend(
+            f"- [{event.get('timestamp', 0):.1f}s] {event.get('description', 'No description')}\n"
+            for event in events
+        )
+    
+    return "".join(parts)
+
 class ConversationManager:
-    def __init__(self, max_history: int = 10, session_timeout_minutes: int = 30):
+    def __init__(self, max_history: int = 10, session_timeout_minutes: int = 30,
+                 store: Optional[SessionStore] = None):
         """
         Initialize conversation manager
         
         Args:
             max_history: Maximum number of messages to retain per session
             session_timeout_minutes: Session timeout in minutes
+            store: Session store backend (defaults to in-memory)
         """
-        self.sessions: Dict[str, Dict] = {}
+        self.store = store or InMemorySessionStore()
         self.max_history = max_history
-        self.session_timeout = timedelta(minutes=session_timeout_minutes)
+        self.session_timeout_seconds = session_timeout_minutes * 60
     
-    def create_session(self) -> str:
+    async def create_session(self) -> str:
         """
         Create a new conversation session
         
@@ -32,18 +132,19 @@ class ConversationManager:
             Session ID
         """
         session_id = str(uuid.uuid4())
-        self.sessions[session_id] = {
+        await self.store.set(session_id, {
             'id': session_id,
-            'created_at': datetime.now(),
-            'last_activity': datetime.now(),
+            'created_at': time.time(),
+            'last_activity': time.time(),
             'conversation_history': [],
+            'system_messages': [],
             'video_analysis': None,
             'context': {}
-        }
+        }, self.session_timeout_seconds)
         logger.info(f"Created new session: {session_id}")
         return session_id
     
-    def get_session(self, session_id: str) -> Optional[Dict]:
+    async def get_session(self, session_id: str) -> Optional[Dict]:
         """
         Get session data
         
@@ -51,23 +152,19 @@ class ConversationManager:
             session_id: Session identifier
             
         Returns:
-            Session data or None if not found
+            Session data or None if not found or expired
         """
-        session = self.sessions.get(session_id)
+        # Expired sessions are evicted by the store
+        session = await self.store.get(session_id)
         
         if session:
-            # Check if session has expired
-            if datetime.now() - session['last_activity'] > self.session_timeout:
-                logger.info(f"Session {session_id} has expired")
-                self.clear_session(session_id)
-                return None
-            
-            # Update last activity
-            session['last_activity'] = datetime.now()
+            # Update last activity; only the timestamp and TTL are written
+            await self.store.update(session_id, {}, self.session_timeout_seconds)
+            session['last_activity'] = time.time()
             
         return session
     
-    def add_message(self, session_id: str, role: str, content: str, metadata: Dict = None):
+    async def add_message(self, session_id: str, role: str, content: str, metadata: Dict = None):
         """
         Add a message to conversation history
         
@@ -77,38 +174,32 @@ class ConversationManager:
             content: Message content
             metadata: Additional metadata
         """
-        session = self.get_session(session_id)
-        
-        if not session:
-            logger.warning(f"Session {session_id} not found")
-            return
-        
         message = {
             'role': role,
             'content': content,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': time.time_ns(),
             'metadata': metadata or {}
         }
         
-        session['conversation_history'].append(message)
-        
-        # Trim history if it exceeds max limit
-        if len(session['conversation_history']) > self.max_history * 2:
-            # Keep system messages and recent history
-            system_messages = [
-                m for m in session['conversation_history'] 
-                if m['role'] == 'system'
-            ]
-            recent_messages = session['conversation_history'][-(self.max_history * 2):]
-            
-            # Combine, removing duplicates
-            session['conversation_history'] = system_messages + [
-                m for m in recent_messages if m not in system_messages
-            ]
+        if role == 'system':
+            # System messages are always kept, outside the rolling window
+            added = await self.store.append_message(
+                session_id, 'system_messages', message, 0, self.session_timeout_seconds
+            )
+        else:
+            # The oldest message is dropped once the window exceeds max limit
+            added = await self.store.append_message(
+                session_id, 'conversation_history', message,
+                self.max_history * 2, self.session_timeout_seconds
+            )
+        
+        if not added:
+            logger.warning(f"Session {session_id} not found")
+            return
         
         logger.debug(f"Added {role} message to session {session_id}")
     
-    def get_conversation_history(self, session_id: str, limit: int = None) -> List[Dict]:
+    async def get_conversation_history(self, session_id: str, limit: int = None) -> List[Dict]:
         """
         Get conversation history for a session
         
@@ -119,19 +210,14 @@ class ConversationManager:
         Returns:
             List of messages
         """
-        session = self.get_session(session_id)
+        session = await self.get_session(session_id)
         
         if not session:
             return []
         
-        history = session['conversation_history']
-        
-        if limit:
-            return history[-limit:]
-        
-        return history
+        return session_history(session, limit)
     
-    def store_video_analysis(self, session_id: str, events: List[Dict], 
+    async def store_video_analysis(self, session_id: str, events: List[Dict], 
                             summary: str, guidelines: Dict):
         """
         Store video analysis results in session
@@ -142,21 +228,34 @@ class ConversationManager:
             summary: Video summary
             guidelines: Guideline adherence information
         """
-        session = self.get_session(session_id)
+        # Keep events in time order with a parallel timestamp list for bisect lookups
+        events = sorted(events, key=lambda e: e.get('timestamp', 0))
         
-        if not session:
-            logger.warning(f"Session {session_id} not found")
-            return
+        # Index event positions by lowercased event type
+        event_type_index = defaultdict(list)
+        for i, event in enumerate(events):
+            event_type_index[(event.get('event_type') or '').lower()].append(i)
         
-        session['video_analysis'] = {
+        video_analysis = {
             'events': events,
+            '_timestamps': [e.get('timestamp', 0) for e in events],
+            '_event_type_index': dict(event_type_index),
             'summary': summary,
             'guidelines': guidelines,
             'analyzed_at': datetime.now().isoformat()
         }
+        # Render the prompt section once; it only changes with a new analysis
+        video_analysis['_system_prompt_cache'] = render_analysis_context(video_analysis)
+        
+        # Only the analysis is written, so concurrent messages are not overwritten
+        if not await self.store.update(
+            session_id, {'video_analysis': video_analysis}, self.session_timeout_seconds
+        ):
+            logger.warning(f"Session {session_id} not found")
+            return
         
         # Add system message about video analysis
-        self.add_message(
+        await self.add_message(
             session_id,
             'system',
             f"Video analyzed. Found {len(events)} events. Summary: {summary[:200]}...",
@@ -165,7 +264,7 @@ class ConversationManager:
         
         logger.info(f"Stored video analysis for session {session_id}")
     
-    def get_video_analysis(self, session_id: str) -> Optional[Dict]:
+    async def get_video_analysis(self, session_id: str) -> Optional[Dict]:
         """
         Get video analysis results for a session
         
@@ -175,14 +274,14 @@ class ConversationManager:
         Returns:
             Video analysis data or None
         """
-        session = self.get_session(session_id)
+        session = await self.get_session(session_id)
         
         if session:
             return session.get('video_analysis')
         
         return None
     
-    def update_context(self, session_id: str, context_key: str, context_value: Any):
+    async def update_context(self, session_id: str, context_key: str, context_value: Any):
         """
         Update session context
         
@@ -191,13 +290,12 @@ class ConversationManager:
             context_key: Context key
             context_value: Context value
         """
-        session = self.get_session(session_id)
-        
-        if session:
-            session['context'][context_key] = context_value
+        if await self.store.set_context(
+            session_id, context_key, context_value, self.session_timeout_seconds
+        ):
             logger.debug(f"Updated context '{context_key}' for session {session_id}")
     
-    def get_context(self, session_id: str) -> Dict:
+    async def get_context(self, session_id: str) -> Dict:
         """
         Get session context
         
@@ -207,52 +305,42 @@ class ConversationManager:
         Returns:
             Session context dictionary
         """
-        session = self.get_session(session_id)
+        session = await self.get_session(session_id)
         
         if session:
             return session.get('context', {})
         
         return {}
     
-    def clear_session(self, session_id: str):
+    async def clear_session(self, session_id: str):
         """
         Clear a conversation session
         
         Args:
             session_id: Session identifier
         """
-        if session_id in self.sessions:
-            del self.sessions[session_id]
-            logger.info(f"Cleared session {session_id}")
+        await self.store.delete(session_id)
+        logger.info(f"Cleared session {session_id}")
     
-    def clear_expired_sessions(self):
+    async def clear_expired_sessions(self):
         """
         Clear all expired sessions
         """
-        current_time = datetime.now()
-        expired_sessions = []
-        
-        for session_id, session in self.sessions.items():
-            if current_time - session['last_activity'] > self.session_timeout:
-                expired_sessions.append(session_id)
-        
-        for session_id in expired_sessions:
-            self.clear_session(session_id)
+        expired_sessions = await self.store.scan_expired()
         
         if expired_sessions:
             logger.info(f"Cleared {len(expired_sessions)} expired sessions")
     
-    def get_active_sessions_count(self) -> int:
+    async def get_active_sessions_count(self) -> int:
         """
         Get count of active sessions
         
         Returns:
             Number of active sessions
         """
-        self.clear_expired_sessions()
-        return len(self.sessions)
+        return await self.store.count()
     
-    def export_session(self, session_id: str) -> Optional[str]:
+    async def export_session(self, session_id: str) -> Optional[str]:
         """
         Export session data as JSON
         
@@ -262,19 +350,16 @@ class ConversationManager:
         Returns:
             JSON string or None
         """
-        session = self.get_session(session_id)
+        session = await self.get_session(session_id)
         
         if session:
-            # Convert datetime objects to strings
-            export_data = {
-                'id': session['id'],
-                'created_at': session['created_at'].isoformat(),
-                'last_activity': session['last_activity'].isoformat(),
-                'conversation_history': session['conversation_history'],
-                'video_analysis': session['video_analysis'],
-                'context': session['context']
-            }
-            
-            return json.dumps(export_data, indent=2)
+            export_data = serialize_session(session)
+            return orjson.dumps(export_data, option=orjson.OPT_INDENT_2).decode()
         
         return None
+    
+    async def aclose(self):
+        """
+        Release the session store's connections
+        """
+        await self.store.aclose()
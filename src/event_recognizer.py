@@ -4,32 +4,199 @@ Uses Vision Language Models to detect and analyze events in video frames
 """
 
 import os
+import re
 import base64
-from typing import List, Dict, Tuple, Any
+import random
+import asyncio
+from collections import deque
+from bisect import bisect_left
+from typing import List, Dict, Tuple, Any, Iterable, AsyncIterable, AsyncIterator, Deque, Optional, Union
 import json
+import orjson
 from datetime import datetime
 import io
 from PIL import Image
 import logging
-from openai import OpenAI
+from openai import AsyncOpenAI, RateLimitError, APIConnectionError, InternalServerError, BadRequestError
+import httpx
+import diskcache
 import time
 
+from src.config import get_settings
+from src.frame_store import FrameStore
+from src.video_processor import reencode_as_jpeg
+
 logger = logging.getLogger(__name__)
 
+# System prompt for frame analysis
+_SYSTEM_PROMPT = """You are an expert video analyst with specialized knowledge in traffic laws, safety regulations, and behavioral analysis. 
+
+THOROUGHLY analyze these video frames for:
+
+1. TRAFFIC & VEHICLE ANALYSIS:
+   - Traffic light status (red, yellow, green)
+   - Vehicle movements and positions
+   - Lane changes, turns, stops
+   - Speed estimation (normal, fast, slow)
+   - Following distance
+   - Use of indicators/signals
+   - Parking violations
+   - Running red lights or stop signs
+
+2. PEDESTRIAN & CYCLIST ACTIVITY:
+   - Pedestrian crossings (jaywalking, crossing at signals)
+   - Pedestrian signal compliance
+   - Cyclist behavior and lane usage
+   - Near-miss incidents
+   - Right of way violations
+
+3. ENVIRONMENTAL CONTEXT:
+   - Road conditions (wet, dry, construction)
+   - Weather conditions
+   - Time of day/lighting conditions
+   - Road signs and markings
+   - Traffic control devices
+
+4. SAFETY & COMPLIANCE:
+   - Seatbelt usage (if visible)
+   - Phone usage while driving
+   - Aggressive driving behaviors
+   - Emergency vehicle interactions
+   - Construction zone compliance
+   - School zone violations
+
+5. GENERAL OBSERVATIONS:
+   - Unusual or noteworthy events
+   - Potential hazards
+   - Good driving practices observed
+   - Traffic flow patterns
+
+BE SPECIFIC: Instead of "traffic at intersection", describe "vehicle approaching red light at 15mph" or "pedestrians waiting at crosswalk with walk signal"
+
+Return a JSON array where EACH detected element gets its own entry:
+{
+    "timestamp": float,
+    "event_type": "traffic_signal|vehicle_movement|pedestrian_activity|violation|hazard|environmental|other",
+    "description": "Detailed description of what is happening",
+    "objects": ["car", "pedestrian", "traffic_light", "crosswalk", etc.],
+    "location_in_frame": "top-left|top-center|top-right|center-left|center|center-right|bottom-left|bottom-center|bottom-right",
+    "severity": "info|low|medium|high|critical",
+    "guideline_violation": boolean,
+    "violation_details": "Specific law or guideline violated if applicable",
+    "confidence": 0.0-1.0
+}"""
+
+# Response format used when several batches share one request
+_SUPERBATCH_FORMAT = """
+
+The frames are grouped into numbered batches. Instead of a single array, return a JSON object
+with one entry per batch, where each "events" array holds entries in the format above:
+{"batches": [{"index": int, "events": [...]}, ...]}"""
+
+# Instructions used when batches are sent as a key frame plus thumbnails
+_DELTA_FORMAT = """
+
+Each batch has one KEY frame at full resolution; the other frames are low-resolution
+DELTA frames of the same scene. Use the key frame as the reference and describe what
+changes in each delta frame, with that frame's timestamp."""
+
+# Response format used with json_object mode, which does not allow top-level arrays
+_JSON_OBJECT_FORMAT = """
+
+Wrap the array in a JSON object: {"events": [...]}"""
+
+# Matches 400 errors that blame the image format rather than, say, context length
+_IMAGE_FORMAT_ERROR = re.compile(
+    r"webp|mime|image[ _]?(format|type)|(unsupported|invalid)[ _]image|decode[ _]image",
+    re.IGNORECASE
+)
+
 class EventRecognizer:
     """Handles event recognition in video frames using AI vision models"""
     
-    def __init__(self):
-        # Use Nebius AI Studio with OpenAI-compatible API
-        self.client = OpenAI(
-            base_url="https://api.studio.nebius.com/v1/",
-            api_key=os.getenv("NEBIUS_API_KEY")
+    def __init__(self, max_concurrent: int = None, max_retries: int = 5,
+                 tokens_per_minute: int = None, frame_store: Optional[FrameStore] = None):
+        """
+        Initialize event recognizer
+        
+        Args:
+            max_concurrent: Maximum VLM requests in flight per video
+            max_retries: Retries for rate-limited or failed requests
+            tokens_per_minute: Token budget per minute (0 for unlimited)
+            frame_store: Store frames are uploaded to and referenced by URL
+                (defaults to FRAME_STORE_URL; frames are sent inline when unset)
+        """
+        settings = get_settings()
+        
+        if frame_store is None and settings.frame_store_url:
+            frame_store = FrameStore(settings.frame_store_url)
+        self.frame_store = frame_store
+        
+        # Use Nebius AI Studio with OpenAI-compatible API over a pooled async client
+        self.client = AsyncOpenAI(
+            base_url=settings.nebius_base_url,
+            api_key=settings.nebius_api_key,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+                timeout=120
+            )
+        )
+        
+        # Request fan-out and rate limiting
+        self.max_concurrent = max_concurrent or settings.vlm_max_concurrent
+        self.max_retries = max_retries
+        self.tokens_per_minute = (
+            settings.vlm_tokens_per_minute if tokens_per_minute is None else tokens_per_minute
         )
+        # (time, tokens) of completions in the last minute
+        self._token_window: Deque[Tuple[float, int]] = deque()
+        self._tokens_in_window = 0
+        
+        # Per-frame events keyed by model and JPEG content hash, kept across runs
+        self._event_cache = (
+            diskcache.Cache(os.path.expanduser(settings.event_cache_dir))
+            if settings.event_cache_dir else None
+        )
+        # Frames within this dHash distance of the previous kept frame are skipped
+        self.dedup_distance = settings.frame_dedup_distance
+        
+        # Batches of frames sent in a single request when RPM-bound
+        self.batches_per_request = settings.vlm_batches_per_request
+        
         # Use Qwen2-VL-72B for vision tasks (multimodal model)
         self.model = "Qwen/Qwen2-VL-72B-Instruct"
         # Use Google Gemma-3-27B for chat/summarization tasks
         self.chat_model = "google/gemma-3-27b-it"
         
+        # Send one full-resolution key frame per batch and thumbnails for the rest
+        self.keyframe_deltas = settings.vlm_keyframe_deltas
+        system_prompt = _SYSTEM_PROMPT + (_DELTA_FORMAT if self.keyframe_deltas else "")
+        
+        # Results depend on the frames' resolution, so each mode has its own cache entries
+        self._cache_prefix = f"{self.model}:delta:" if self.keyframe_deltas else f"{self.model}:"
+        
+        # Ask for json_object responses where the endpoint supports it; that mode
+        # only allows objects, so single-batch responses wrap the array
+        self.json_mode = settings.vlm_json_mode
+        self._response_format = (
+            {"response_format": {"type": "json_object"}} if self.json_mode else {}
+        )
+        
+        # System messages are built once and reused by every request
+        self._system_msg = {
+            "role": "system",
+            "content": system_prompt + (_JSON_OBJECT_FORMAT if self.json_mode else "")
+        }
+        self._superbatch_system_msg = {
+            "role": "system", "content": system_prompt + _SUPERBATCH_FORMAT
+        }
+        
+        # Set once the endpoint rejects a non-JPEG image; later frames are sent as JPEG
+        self._jpeg_only = False
+        
+        # Parses the first JSON value in a response, ignoring any trailing prose
+        self._decoder = json.JSONDecoder()
+        
         # Define common guideline types for different scenarios
         self.guidelines = {
             "traffic": [
@@ -54,25 +221,108 @@ class EventRecognizer:
             ]
         }
     
-    def detect_events(self, frames: List[dict]) -> List[dict]:
+    async def aclose(self):
+        """
+        Close the pooled HTTP connections to the VLM endpoint
+        """
+        await self.client.close()
+        
+        if self.frame_store is not None:
+            await self.frame_store.aclose()
+        
+        if self._event_cache is not None:
+            self._event_cache.close()
+    
+    async def _wait_for_token_budget(self):
+        """
+        Wait until the last minute's token usage is under the budget
+        """
+        if not self.tokens_per_minute:
+            return
+        
+        while True:
+            now = time.monotonic()
+            while self._token_window and now - self._token_window[0][0] >= 60:
+                _, tokens = self._token_window.popleft()
+                self._tokens_in_window -= tokens
+            
+            if self._tokens_in_window < self.tokens_per_minute:
+                return
+            
+            await asyncio.sleep(60 - (now - self._token_window[0][0]))
+    
+    async def _create_completion(self, **kwargs):
+        """
+        Call the chat completions API with retries and exponential backoff
+        
+        Args:
+            **kwargs: Arguments for chat.completions.create
+            
+        Returns:
+            Chat completion response
+        """
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_token_budget()
+            
+            try:
+                response = await self.client.chat.completions.create(**kwargs)
+                break
+            except (RateLimitError, APIConnectionError, InternalServerError) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = min(2 ** attempt, 30) + random.random()
+                logger.warning(f"VLM request failed ({str(e)}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+        
+        if response.usage:
+            self._token_window.append((time.monotonic(), response.usage.total_tokens))
+            self._tokens_in_window += response.usage.total_tokens
+        
+        return response
+    
+    async def detect_events(self, frames: Union[Iterable[dict], AsyncIterable[dict]]) -> List[dict]:
         """
         Detect events in video frames using Vision Language Model
         
         Args:
-            frames: List of frame data with base64 images
+            frames: Frame data with base64 images; may be a lazy or async
+                iterator, in which case each batch is sent as soon as it fills
             
         Returns:
             List of detected events with timestamps
         """
         events = []
+        tasks = []
         
         try:
-            # Analyze frames in batches for efficiency
+            semaphore = asyncio.Semaphore(self.max_concurrent)
+            
+            async def analyze(batches: List[List[dict]]) -> List[dict]:
+                async with semaphore:
+                    if len(batches) == 1:
+                        return await self._analyze_frame_batch(batches[0])
+                    return await self._analyze_superbatch(batches)
+            
+            def submit(group: List[dict]):
+                batches = [group[i:i + batch_size] for i in range(0, len(group), batch_size)]
+                tasks.append(asyncio.create_task(analyze(batches)))
+            
+            # Analyze uncached frames in batches, with up to max_concurrent requests in flight;
+            # batches_per_request batches are combined into each request. Requests start
+            # while later frames are still being extracted.
             batch_size = 5
-            for i in range(0, len(frames), batch_size):
-                batch = frames[i:i+batch_size]
-                batch_events = self._analyze_frame_batch(batch)
-                events.extend(batch_events)
+            group_size = batch_size * self.batches_per_request
+            group = []
+            async for frame in self._frames_to_analyze(frames, events, group_size):
+                group.append(frame)
+                if len(group) == group_size:
+                    submit(group)
+                    group = []
+            if group:
+                submit(group)
+            
+            for task in asyncio.as_completed(tasks):
+                events.extend(await task)
             
             # Sort events by timestamp
             events.sort(key=lambda x: x['timestamp'])
@@ -82,9 +332,375 @@ class EventRecognizer:
             
         except Exception as e:
             logger.error(f"Error detecting events: {str(e)}")
+            for task in tasks:
+                task.cancel()
             return []
     
-    def _analyze_frame_batch(self, frames: List[dict]) -> List[dict]:
+    async def _frames_to_analyze(self, frames: Union[Iterable[dict], AsyncIterable[dict]],
+                                 cached_events: List[dict], lookup_size: int) -> AsyncIterator[dict]:
+        """
+        Skip near-duplicate frames and frames whose events are already cached
+        
+        Args:
+            frames: Frame data with content hash and dHash
+            cached_events: Receives the cached events of skipped frames
+            lookup_size: Frames looked up in the event cache together
+            
+        Yields:
+            Frames that need to be sent to the model
+        """
+        if not isinstance(frames, AsyncIterable):
+            frames = self._as_async(frames)
+        
+        last_dhash = None
+        pending = []
+        
+        async for frame in frames:
+            frame_dhash = frame.get('dhash')
+            if frame_dhash is not None:
+                if (last_dhash is not None and
+                        bin(frame_dhash ^ last_dhash).count('1') <= self.dedup_distance):
+                    continue
+                last_dhash = frame_dhash
+            
+            if self._event_cache is None:
+                yield frame
+                continue
+            
+            pending.append(frame)
+            if len(pending) == lookup_size:
+                for uncached in await self._split_cached(pending, cached_events):
+                    yield uncached
+                pending = []
+        
+        if pending:
+            for uncached in await self._split_cached(pending, cached_events):
+                yield uncached
+    
+    @staticmethod
+    async def _as_async(frames: Iterable[dict]) -> AsyncIterator[dict]:
+        """
+        Wrap a synchronous frame iterable as an async iterator
+        """
+        for frame in frames:
+            yield frame
+    
+    async def _split_cached(self, frames: List[dict], cached_events: List[dict]) -> List[dict]:
+        """
+        Look up a group of frames in the event cache off the event loop
+        
+        Args:
+            frames: Frame data
+            cached_events: Receives the events of cached frames, re-stamped with
+                their position
+            
+        Returns:
+            Frames missing from the cache
+        """
+        cached = await asyncio.to_thread(self._load_cached_events, frames)
+        uncached = []
+        
+        for frame, frame_events in zip(frames, cached):
+            if frame_events is None:
+                uncached.append(frame)
+            else:
+                cached_events.extend(
+                    {**event, 'timestamp': frame['timestamp'], 'frame_number': frame['frame_number']}
+                    for event in frame_events
+                )
+        
+        return uncached
+    
+    def _load_cached_events(self, frames: List[dict]) -> List[Optional[List[dict]]]:
+        """
+        Read the events previously detected in identical frames (blocking)
+        
+        Args:
+            frames: Frame data
+            
+        Returns:
+            Each frame's cached events, or None on a cache miss
+        """
+        return [
+            self._event_cache.get(f"{self._cache_prefix}{frame['hash']}")
+            if 'hash' in frame else None
+            for frame in frames
+        ]
+    
+    async def _cache_events(self, batches: List[Tuple[List[dict], List[dict]]]):
+        """
+        Store the events detected in batches under each frame's content hash,
+        off the event loop
+        
+        Args:
+            batches: (frames, events) of each batch, with frame numbers assigned
+        """
+        if self._event_cache is None or not batches:
+            return
+        
+        await asyncio.to_thread(self._store_events, batches)
+    
+    def _store_events(self, batches: List[Tuple[List[dict], List[dict]]]):
+        """
+        Write batches' events to the event cache in one transaction (blocking)
+        
+        Args:
+            batches: (frames, events) of each batch, with frame numbers assigned
+        """
+        with self._event_cache.transact():
+            for frames, events in batches:
+                events_by_frame = {frame['frame_number']: [] for frame in frames}
+                for event in events:
+                    events_by_frame[event['frame_number']].append(event)
+                
+                for frame in frames:
+                    if 'hash' in frame:
+                        self._event_cache.set(
+                            f"{self._cache_prefix}{frame['hash']}",
+                            events_by_frame[frame['frame_number']]
+                        )
+    
+    async def _prepare_frames(self, frames: List[dict]):
+        """
+        Convert frames to a format the endpoint accepts, then upload them to the
+        frame store and record their URLs on the frame data
+        
+        Frames that fail to upload keep being sent inline.
+        
+        Args:
+            frames: Frame data with base64 image and content hash
+        """
+        if self._jpeg_only:
+            convert = [f for f in frames if f.get('mime', 'image/jpeg') != 'image/jpeg']
+            if convert:
+                # Decoding and re-encoding is CPU-bound; keep it off the event loop
+                await asyncio.to_thread(lambda: [reencode_as_jpeg(f) for f in convert])
+        
+        if self.frame_store is None:
+            return
+        
+        unpublished = [f for f in frames if 'url' not in f and 'hash' in f]
+        urls = await asyncio.gather(*(self.frame_store.publish(f) for f in unpublished))
+        
+        for frame, url in zip(unpublished, urls):
+            if url is not None:
+                frame['url'] = url
+    
+    def _fall_back_to_jpeg(self, error: BadRequestError, frames: List[dict]) -> bool:
+        """
+        Switch to JPEG after a request that included other image formats was
+        rejected because of its image format
+        
+        Args:
+            error: Error the request was rejected with
+            frames: Frames of the rejected request
+            
+        Returns:
+            True if the request should be retried with JPEG frames
+        """
+        if all(f.get('mime', 'image/jpeg') == 'image/jpeg' for f in frames):
+            return False
+        
+        # Other 400s (context length, image count, content filter) are not retried
+        if not _IMAGE_FORMAT_ERROR.search(f"{error.code or ''} {error.message}"):
+            return False
+        
+        # Concurrent requests can be rejected after the switch; they are retried too,
+        # and _prepare_frames re-encodes their frames before resending
+        
+        if not self._jpeg_only:
+            logger.warning("Request with non-JPEG frames was rejected, falling back to JPEG")
+            self._jpeg_only = True
+        return True
+    
+    def _parse_json(self, response_text: str, start_idx: int) -> Any:
+        """
+        Parse the JSON value starting at start_idx in a model response
+        
+        Args:
+            response_text: Model response
+            start_idx: Index of the value's opening bracket
+            
+        Returns:
+            Parsed value
+            
+        Raises:
+            json.JSONDecodeError: If no valid JSON value starts at start_idx
+        """
+        # Models often close the value with a code fence; drop it so the fast path applies
+        text = response_text[start_idx:].rstrip()
+        if text.endswith('```'):
+            text = text[:-3]
+        
+        try:
+            # Fast path: the JSON runs to the end of the response
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            # Recover from trailing prose
+            value, _ = self._decoder.raw_decode(response_text, start_idx)
+            return value
+    
+    def _image_content(self, frame: dict, thumbnail: bool = False) -> dict:
+        """
+        Build the message content part carrying a frame's image
+        
+        Args:
+            frame: Frame data with base64 image, and a URL if published
+            thumbnail: Send the frame's low-resolution thumbnail instead
+            
+        Returns:
+            image_url content part
+        """
+        mime_type = frame.get('mime', 'image/jpeg')
+        
+        if thumbnail:
+            url = f"data:{mime_type};base64,{frame['thumbnail']}"
+        else:
+            url = frame.get('url') or f"data:{mime_type};base64,{frame['image']}"
+        
+        return {
+            "type": "image_url",
+            "image_url": {
+                "url": url
+            }
+        }
+    
+    def _batch_image_content(self, frames: List[dict]) -> List[dict]:
+        """
+        Build the message content parts carrying a batch's images
+        
+        In key frame mode, the middle frame is sent at full resolution and the
+        others as labelled thumbnails, cutting the batch's image tokens.
+        
+        Args:
+            frames: Batch of frame data
+            
+        Returns:
+            Content parts
+        """
+        if not self.keyframe_deltas or len(frames) < 2 or not all('thumbnail' in f for f in frames):
+            return [self._image_content(frame) for frame in frames]
+        
+        key_frame = frames[len(frames) // 2]
+        content = [
+            {"type": "text", "text": f"KEY frame at {key_frame['timestamp']:.1f}s:"},
+            self._image_content(key_frame)
+        ]
+        
+        for frame in frames:
+            if frame is not key_frame:
+                content.append({"type": "text", "text": f"DELTA frame at {frame['timestamp']:.1f}s:"})
+                content.append(self._image_content(frame, thumbnail=True))
+        
+        return content
+    
+    def _fallback_events(self, frames: List[dict]) -> List[dict]:
+        """
+        Create a general scene event per frame when the response cannot be parsed
+        
+        Args:
+            frames: Frame data
+            
+        Returns:
+            List of scene events
+        """
+        return [
+            {
+                "timestamp": frame['timestamp'],
+                "frame_number": frame['frame_number'],
+                "event_type": "scene",
+                "description": "Scene captured",
+                "objects": [],
+                "severity": "low",
+                "guideline_violation": False,
+                "violation_details": None
+            }
+            for frame in frames
+        ]
+    
+    async def _analyze_superbatch(self, batches: List[List[dict]]) -> List[dict]:
+        """
+        Analyze several batches of frames in a single request
+        
+        Args:
+            batches: Batches of frame data
+            
+        Returns:
+            List of events detected in all batches
+        """
+        events = []
+        
+        try:
+            await self._prepare_frames([f for frames in batches for f in frames])
+            
+            content = [{
+                "type": "text",
+                "text": f"Analyze these {len(batches)} batches of frames from a video."
+            }]
+            
+            # Each batch is introduced by a delimiter, followed by its images
+            for k, frames in enumerate(batches):
+                content.append({
+                    "type": "text",
+                    "text": f"=== Batch {k}, timestamps: " +
+                            ", ".join([f"{f['timestamp']:.1f}s" for f in frames])
+                })
+                content.extend(self._batch_image_content(frames))
+            
+            messages = [
+                self._superbatch_system_msg,
+                {"role": "user", "content": content}
+            ]
+            
+            response = await self._create_completion(
+                model=self.model,
+                messages=messages,
+                max_tokens=1000 * len(batches),
+                temperature=0.3,
+                **self._response_format
+            )
+            
+            response_text = response.choices[0].message.content
+            
+            # Extract JSON object from response
+            try:
+                start_idx = response_text.find('{')
+                if start_idx != -1:
+                    result = self._parse_json(response_text, start_idx)
+                    detected = []
+                    
+                    for entry in result.get('batches', []):
+                        index = entry.get('index')
+                        if not isinstance(index, int) or not 0 <= index < len(batches):
+                            continue
+                        
+                        # Assign frame numbers from the batch the events belong to
+                        frames = batches[index]
+                        detected_events = entry.get('events', [])
+                        self._assign_frames(detected_events, frames)
+                        
+                        events.extend(detected_events)
+                        detected.append((frames, detected_events))
+                    
+                    await self._cache_events(detected)
+            except json.JSONDecodeError:
+                logger.warning("Could not parse JSON from response, using fallback")
+                for frames in batches:
+                    events.extend(self._fallback_events(frames))
+            
+            return events
+            
+        except BadRequestError as e:
+            if self._fall_back_to_jpeg(e, [f for frames in batches for f in frames]):
+                return await self._analyze_superbatch(batches)
+            logger.error(f"Error analyzing frame superbatch: {str(e)}")
+            return []
+            
+        except Exception as e:
+            logger.error(f"Error analyzing frame superbatch: {str(e)}")
+            return []
+    
+    async def _analyze_frame_batch(self, frames: List[dict]) -> List[dict]:
         """
         Analyze a batch of frames for events
         
@@ -97,67 +713,11 @@ class EventRecognizer:
         events = []
         
         try:
+            await self._prepare_frames(frames)
+            
             # Prepare messages for GPT-4 Vision
             messages = [
-                {
-                    "role": "system",
-                    "content": """You are an expert video analyst with specialized knowledge in traffic laws, safety regulations, and behavioral analysis. 
-                    
-                    THOROUGHLY analyze these video frames for:
-                    
-                    1. TRAFFIC & VEHICLE ANALYSIS:
-                       - Traffic light status (red, yellow, green)
-                       - Vehicle movements and positions
-                       - Lane changes, turns, stops
-                       - Speed estimation (normal, fast, slow)
-                       - Following distance
-                       - Use of indicators/signals
-                       - Parking violations
-                       - Running red lights or stop signs
-                    
-                    2. PEDESTRIAN & CYCLIST ACTIVITY:
-                       - Pedestrian crossings (jaywalking, crossing at signals)
-                       - Pedestrian signal compliance
-                       - Cyclist behavior and lane usage
-                       - Near-miss incidents
-                       - Right of way violations
-                    
-                    3. ENVIRONMENTAL CONTEXT:
-                       - Road conditions (wet, dry, construction)
-                       - Weather conditions
-                       - Time of day/lighting conditions
-                       - Road signs and markings
-                       - Traffic control devices
-                    
-                    4. SAFETY & COMPLIANCE:
-                       - Seatbelt usage (if visible)
-                       - Phone usage while driving
-                       - Aggressive driving behaviors
-                       - Emergency vehicle interactions
-                       - Construction zone compliance
-                       - School zone violations
-                    
-                    5. GENERAL OBSERVATIONS:
-                       - Unusual or noteworthy events
-                       - Potential hazards
-                       - Good driving practices observed
-                       - Traffic flow patterns
-                    
-                    BE SPECIFIC: Instead of "traffic at intersection", describe "vehicle approaching red light at 15mph" or "pedestrians waiting at crosswalk with walk signal"
-                    
-                    Return a JSON array where EACH detected element gets its own entry:
-                    {
-                        "timestamp": float,
-                        "event_type": "traffic_signal|vehicle_movement|pedestrian_activity|violation|hazard|environmental|other",
-                        "description": "Detailed description of what is happening",
-                        "objects": ["car", "pedestrian", "traffic_light", "crosswalk", etc.],
-                        "location_in_frame": "top-left|top-center|top-right|center-left|center|center-right|bottom-left|bottom-center|bottom-right",
-                        "severity": "info|low|medium|high|critical",
-                        "guideline_violation": boolean,
-                        "violation_details": "Specific law or guideline violated if applicable",
-                        "confidence": 0.0-1.0
-                    }"""
-                },
+                self._system_msg,
                 {
                     "role": "user",
                     "content": [
@@ -171,20 +731,15 @@ class EventRecognizer:
             ]
             
             # Add frame images to the message
-            for frame in frames:
-                messages[1]["content"].append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{frame['image']}"
-                    }
-                })
+            messages[1]["content"].extend(self._batch_image_content(frames))
             
             # Call GPT-4 Vision
-            response = self.client.chat.completions.create(
+            response = await self._create_completion(
                 model=self.model,
                 messages=messages,
                 max_tokens=1000,
-                temperature=0.3
+                temperature=0.3,
+                **self._response_format
             )
             
             # Parse response
@@ -192,57 +747,73 @@ class EventRecognizer:
             
             # Extract JSON from response
             try:
-                # Find JSON array in response
-                start_idx = response_text.find('[')
-                end_idx = response_text.rfind(']') + 1
-                if start_idx != -1 and end_idx > start_idx:
-                    json_str = response_text[start_idx:end_idx]
-                    detected_events = json.loads(json_str)
+                # Find JSON array (or wrapping object) in response and parse it in one pass
+                start_idx = response_text.find('{' if self.json_mode else '[')
+                if start_idx != -1:
+                    detected_events = self._parse_json(response_text, start_idx)
+                    if isinstance(detected_events, dict):
+                        detected_events = detected_events.get('events', [])
                     
                     # Add frame information to events
-                    for event in detected_events:
-                        event['frame_number'] = self._find_closest_frame(
-                            event.get('timestamp', 0), frames
-                        )
+                    self._assign_frames(detected_events, frames)
                     
                     events.extend(detected_events)
+                    await self._cache_events([(frames, detected_events)])
             except json.JSONDecodeError:
                 logger.warning("Could not parse JSON from response, using fallback")
                 # Fallback: create a general event
-                for frame in frames:
-                    events.append({
-                        "timestamp": frame['timestamp'],
-                        "frame_number": frame['frame_number'],
-                        "event_type": "scene",
-                        "description": "Scene captured",
-                        "objects": [],
-                        "severity": "low",
-                        "guideline_violation": False,
-                        "violation_details": None
-                    })
+                events.extend(self._fallback_events(frames))
             
             return events
             
+        except BadRequestError as e:
+            if self._fall_back_to_jpeg(e, frames):
+                return await self._analyze_frame_batch(frames)
+            logger.error(f"Error analyzing frame batch: {str(e)}")
+            return []
+            
         except Exception as e:
             logger.error(f"Error analyzing frame batch: {str(e)}")
             return []
     
-    def _find_closest_frame(self, timestamp: float, frames: List[dict]) -> int:
+    def _assign_frames(self, events: List[dict], frames: List[dict]):
+        """
+        Set each event's frame_number to the frame closest to its timestamp
+        
+        Args:
+            events: Events parsed from the model response
+            frames: Frames the events were detected in, in time order
+        """
+        timestamps = [f['timestamp'] for f in frames]
+        
+        for event in events:
+            event['frame_number'] = self._find_closest_frame(
+                event.get('timestamp', 0), frames, timestamps
+            )
+    
+    def _find_closest_frame(self, timestamp: float, frames: List[dict],
+                            timestamps: List[float]) -> int:
         """
         Find the frame number closest to a given timestamp
+        
+        Args:
+            timestamp: Event timestamp
+            frames: Frames in time order
+            timestamps: Timestamps of frames
+            
+        Returns:
+            Frame number of the closest frame (the earlier one on ties)
         """
-        closest_frame = frames[0]['frame_number']
-        min_diff = abs(frames[0]['timestamp'] - timestamp)
+        i = bisect_left(timestamps, timestamp)
         
-        for frame in frames[1:]:
-            diff = abs(frame['timestamp'] - timestamp)
-            if diff < min_diff:
-                min_diff = diff
-                closest_frame = frame['frame_number']
+        if i == len(timestamps):
+            return frames[-1]['frame_number']
+        if i > 0 and timestamp - timestamps[i - 1] <= timestamps[i] - timestamp:
+            i -= 1
         
-        return closest_frame
+        return frames[i]['frame_number']
     
-    def generate_summary(self, events: List[dict]) -> tuple[str, dict]:
+    async def generate_summary(self, events: List[dict]) -> tuple[str, dict]:
         """
         Generate a comprehensive summary of events and guideline adherence
         
@@ -256,10 +827,23 @@ class EventRecognizer:
             if not events:
                 return "No significant events detected in the video.", {}
             
-            # Analyze guideline violations
-            violations = [e for e in events if e.get('guideline_violation', False)]
-            high_severity = [e for e in events if e.get('severity') == 'high']
-            medium_severity = [e for e in events if e.get('severity') == 'medium']
+            # Analyze guideline violations and severities in a single pass
+            violations = []
+            high_severity_count = 0
+            medium_severity_count = 0
+            for e in events:
+                severity = e.get('severity')
+                if severity == 'high':
+                    high_severity_count += 1
+                elif severity == 'medium':
+                    medium_severity_count += 1
+                
+                if e.get('guideline_violation', False):
+                    violations.append({
+                        "timestamp": e['timestamp'],
+                        "description": e.get('violation_details', e['description']),
+                        "severity": e['severity']
+                    })
             
             # Build summary using Nebius AI
             messages = [
@@ -312,11 +896,11 @@ class EventRecognizer:
                 },
                 {
                     "role": "user",
-                    "content": f"Events detected in video:\n{json.dumps(events, indent=2)}"
+                    "content": f"Events detected in video:\n{orjson.dumps(events, option=orjson.OPT_INDENT_2).decode()}"
                 }
             ]
             
-            response = self.client.chat.completions.create(
+            response = await self._create_completion(
                 model=self.chat_model,  # Uses google/gemma-3-27b-it
                 messages=messages,
                 max_tokens=500,
@@ -329,17 +913,10 @@ class EventRecognizer:
             guideline_adherence = {
                 "total_events": len(events),
                 "violations_count": len(violations),
-                "high_severity_count": len(high_severity),
-                "medium_severity_count": len(medium_severity),
+                "high_severity_count": high_severity_count,
+                "medium_severity_count": medium_severity_count,
                 "violation_rate": len(violations) / len(events) if events else 0,
-                "violations": [
-                    {
-                        "timestamp": v['timestamp'],
-                        "description": v.get('violation_details', v['description']),
-                        "severity": v['severity']
-                    }
-                    for v in violations
-                ],
+                "violations": violations,
                 "compliance_status": "Good" if len(violations) == 0 else 
                                    "Needs Attention" if len(violations) <= 2 else "Poor"
             }
@@ -369,18 +946,29 @@ class EventRecognizer:
             "results": {}
         }
         
+        # Lowercase each event's searchable text once instead of once per guideline;
+        # the newline keeps a match from spanning both fields
+        event_texts = [
+            ((e.get('description') or '') + '\n' + (e.get('violation_details') or '')).lower()
+            for e in events
+        ]
+        event_violations = [bool(e.get('guideline_violation', False)) for e in events]
+        
         for guideline in guidelines:
-            # Check if any events relate to this guideline
-            related_events = [
-                e for e in events 
-                if guideline.lower() in e.get('description', '').lower() or 
-                   guideline.lower() in e.get('violation_details', '').lower()
-            ]
+            key = guideline.lower()
+            
+            # Tally related events and violations in a single pass
+            related_count = 0
+            violation_count = 0
+            for text, is_violation in zip(event_texts, event_violations):
+                if key in text:
+                    related_count += 1
+                    violation_count += is_violation
             
             analysis["results"][guideline] = {
-                "related_events": len(related_events),
-                "violations": len([e for e in related_events if e.get('guideline_violation', False)]),
-                "status": "Pass" if not any(e.get('guideline_violation', False) for e in related_events) else "Fail"
+                "related_events": related_count,
+                "violations": violation_count,
+                "status": "Pass" if violation_count == 0 else "Fail"
             }
         
         return analysis
@@ -0,0 +1,61 @@
+"""
+Frame Store Module
+Publishes encoded frames once so model requests can reference them by URL
+"""
+
+import base64
+import logging
+from typing import Optional, Set
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+class FrameStore:
+    """Uploads frames with HTTP PUT under their content hash (e.g. to S3 or MinIO)"""
+    
+    def __init__(self, base_url: str):
+        """
+        Initialize frame store
+        
+        Args:
+            base_url: Base URL that accepts PUT and is readable by the model endpoint
+        """
+        self.base_url = base_url.rstrip('/')
+        self.client = httpx.AsyncClient(timeout=30)
+        
+        # Keys already uploaded by this process
+        self._uploaded: Set[str] = set()
+    
+    async def publish(self, frame: dict) -> Optional[str]:
+        """
+        Upload a frame unless it was uploaded before
+        
+        Args:
+            frame: Frame data with base64 image, mime type and content hash
+            
+        Returns:
+            URL of the frame, or None if the upload failed
+        """
+        mime_type = frame.get('mime', 'image/jpeg')
+        key = f"{frame['hash']}.{mime_type.split('/')[1]}"
+        url = f"{self.base_url}/{key}"
+        
+        if key not in self._uploaded:
+            try:
+                response = await self.client.put(
+                    url,
+                    content=base64.b64decode(frame['image']),
+                    headers={"Content-Type": mime_type}
+                )
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                logger.warning(f"Could not upload frame to store: {str(e)}")
+                return None
+            
+            self._uploaded.add(key)
+        
+        return url
+    
+    async def aclose(self):
+        await self.client.aclose()
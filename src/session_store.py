@@ -0,0 +1,432 @@
+"""
+Session Store Module
+Pluggable key-value backends for conversation session state
+"""
+
+import time
+import heapq
+import logging
+from typing import Any, Dict, List, Optional, Protocol, Tuple
+
+import orjson
+import redis.asyncio as redis
+
+logger = logging.getLogger(__name__)
+
+class SessionStore(Protocol):
+    """Key-value backend holding session dicts keyed by session ID"""
+    
+    async def get(self, session_id: str) -> Optional[Dict]:
+        ...
+    
+    async def set(self, session_id: str, session: Dict, ttl_seconds: int):
+        ...
+    
+    async def update(self, session_id: str, fields: Dict, ttl_seconds: int) -> bool:
+        ...
+    
+    async def set_context(self, session_id: str, key: str, value: Any, ttl_seconds: int) -> bool:
+        ...
+    
+    async def append_message(self, session_id: str, field: str, message: Dict,
+                             max_length: int, ttl_seconds: int) -> bool:
+        ...
+    
+    async def delete(self, session_id: str):
+        ...
+    
+    async def scan_expired(self) -> List[str]:
+        ...
+    
+    async def count(self) -> int:
+        ...
+    
+    async def aclose(self):
+        ...
+
+class InMemorySessionStore:
+    """Process-local store, suitable for tests and single-worker deployments"""
+    
+    def __init__(self):
+        self.sessions: Dict[str, Dict] = {}
+        self._expires_at: Dict[str, float] = {}
+        # (expires_at, session_id) entries; superseded ones are skipped lazily
+        self._expiry_heap: List[Tuple[float, str]] = []
+    
+    async def get(self, session_id: str) -> Optional[Dict]:
+        """
+        Get a session, dropping it if its TTL has elapsed
+        
+        Args:
+            session_id: Session identifier
+        
+        Returns:
+            Session data or None if not found or expired
+        """
+        session = self.sessions.get(session_id)
+        
+        if session and time.monotonic() > self._expires_at[session_id]:
+            logger.info(f"Session {session_id} has expired")
+            await self.delete(session_id)
+            return None
+        
+        return session
+    
+    async def set(self, session_id: str, session: Dict, ttl_seconds: int):
+        """
+        Store a session and reset its TTL
+        
+        Args:
+            session_id: Session identifier
+            session: Session data
+            ttl_seconds: Seconds of inactivity before the session expires
+        """
+        self.sessions[session_id] = session
+        self._refresh(session_id, ttl_seconds)
+    
+    def _refresh(self, session_id: str, ttl_seconds: int):
+        """Record activity on a session and reset its TTL"""
+        expires_at = time.monotonic() + ttl_seconds
+        self.sessions[session_id]['last_activity'] = time.time()
+        self._expires_at[session_id] = expires_at
+        heapq.heappush(self._expiry_heap, (expires_at, session_id))
+        
+        # Every TTL refresh leaves a stale entry behind; compact when they dominate
+        if len(self._expiry_heap) > 4 * len(self._expires_at) + 64:
+            self._expiry_heap = [(t, sid) for sid, t in self._expires_at.items()]
+            heapq.heapify(self._expiry_heap)
+    
+    async def update(self, session_id: str, fields: Dict, ttl_seconds: int) -> bool:
+        """
+        Set top-level session fields, recording activity and resetting the TTL
+        
+        Args:
+            session_id: Session identifier
+            fields: Fields to set (none only refreshes the session)
+            ttl_seconds: Seconds of inactivity before the session expires
+        
+        Returns:
+            False if the session was not found
+        """
+        session = await self.get(session_id)
+        
+        if not session:
+            return False
+        
+        session.update(fields)
+        self._refresh(session_id, ttl_seconds)
+        return True
+    
+    async def set_context(self, session_id: str, key: str, value: Any, ttl_seconds: int) -> bool:
+        """
+        Set one session context entry, recording activity and resetting the TTL
+        
+        Args:
+            session_id: Session identifier
+            key: Context key
+            value: Context value
+            ttl_seconds: Seconds of inactivity before the session expires
+        
+        Returns:
+            False if the session was not found
+        """
+        session = await self.get(session_id)
+        
+        if not session:
+            return False
+        
+        session['context'][key] = value
+        self._refresh(session_id, ttl_seconds)
+        return True
+    
+    async def append_message(self, session_id: str, field: str, message: Dict,
+                             max_length: int, ttl_seconds: int) -> bool:
+        """
+        Append a message to one of a session's message lists, recording
+        activity and resetting the TTL
+        
+        Args:
+            session_id: Session identifier
+            field: Message list ('conversation_history' or 'system_messages')
+            message: Message to append
+            max_length: Messages kept in the list, oldest dropped first (0 keeps all)
+            ttl_seconds: Seconds of inactivity before the session expires
+        
+        Returns:
+            False if the session was not found
+        """
+        session = await self.get(session_id)
+        
+        if not session:
+            return False
+        
+        messages = session.setdefault(field, [])
+        messages.append(message)
+        if max_length and len(messages) > max_length:
+            del messages[:-max_length]
+        
+        self._refresh(session_id, ttl_seconds)
+        return True
+    
+    async def delete(self, session_id: str):
+        """
+        Delete a session
+        
+        Args:
+            session_id: Session identifier
+        """
+        self.sessions.pop(session_id, None)
+        self._expires_at.pop(session_id, None)
+    
+    async def scan_expired(self) -> List[str]:
+        """
+        Delete all expired sessions, popping only the expired head of the heap
+        
+        Returns:
+            IDs of the deleted sessions
+        """
+        now = time.monotonic()
+        expired_sessions = []
+        
+        while self._expiry_heap and self._expiry_heap[0][0] < now:
+            expires_at, session_id = heapq.heappop(self._expiry_heap)
+            
+            # Skip entries superseded by a later TTL refresh or a delete
+            if self._expires_at.get(session_id) == expires_at:
+                await self.delete(session_id)
+                expired_sessions.append(session_id)
+        
+        return expired_sessions
+    
+    async def count(self) -> int:
+        return len(self.sessions)
+    
+    async def aclose(self):
+        pass
+
+# Session fields kept in Redis lists instead of the session hash
+MESSAGE_FIELDS = ('conversation_history', 'system_messages')
+
+# Session hash fields holding context entries are prefixed with this
+CONTEXT_FIELD_PREFIX = "context:"
+
+# Sets hash fields (ARGV[3:]) on an existing session, then refreshes
+# last_activity (ARGV[2]) and the TTL (ARGV[1]) of all its keys
+_UPDATE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'last_activity', ARGV[2], unpack(ARGV, 3))
+for i = 1, #KEYS do
+    redis.call('EXPIRE', KEYS[i], ARGV[1])
+end
+return 1
+"""
+
+# Appends a message (ARGV[3]) to an existing session's list KEYS[ARGV[4]],
+# trimming it to ARGV[5] entries, then refreshes last_activity and the TTL
+_APPEND_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+local list = KEYS[tonumber(ARGV[4])]
+local max_length = tonumber(ARGV[5])
+redis.call('RPUSH', list, ARGV[3])
+if max_length > 0 then
+    redis.call('LTRIM', list, -max_length, -1)
+end
+redis.call('HSET', KEYS[1], 'last_activity', ARGV[2])
+for i = 1, #KEYS do
+    redis.call('EXPIRE', KEYS[i], ARGV[1])
+end
+return 1
+"""
+
+class RedisSessionStore:
+    """
+    Redis-backed store shared by every worker process
+    
+    Each session is a hash of JSON-encoded fields plus one list per message
+    field, so writers update only what they change. Writes run as Lua
+    scripts, making each one atomic across workers.
+    """
+    
+    KEY_PREFIX = "sess:"
+    
+    def __init__(self, url: str):
+        """
+        Initialize Redis session store
+        
+        Args:
+            url: Redis connection URL (e.g. redis://localhost:6379/0)
+        """
+        self.redis = redis.from_url(url)
+        self._update = self.redis.register_script(_UPDATE_SCRIPT)
+        self._append = self.redis.register_script(_APPEND_SCRIPT)
+    
+    def _keys(self, session_id: str) -> List[str]:
+        """Session hash key followed by the message list keys"""
+        key = f"{self.KEY_PREFIX}{session_id}"
+        return [key] + [f"{key}:{field}" for field in MESSAGE_FIELDS]
+    
+    async def get(self, session_id: str) -> Optional[Dict]:
+        """
+        Get a session, reading its hash and message lists in one round trip
+        
+        Args:
+            session_id: Session identifier
+        
+        Returns:
+            Session data or None if not found or expired
+        """
+        keys = self._keys(session_id)
+        
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hgetall(keys[0])
+            for key in keys[1:]:
+                pipe.lrange(key, 0, -1)
+            fields, *message_lists = await pipe.execute()
+        
+        if not fields:
+            return None
+        
+        session = {'context': {}}
+        for name, value in fields.items():
+            name = name.decode()
+            if name.startswith(CONTEXT_FIELD_PREFIX):
+                session['context'][name[len(CONTEXT_FIELD_PREFIX):]] = orjson.loads(value)
+            else:
+                session[name] = orjson.loads(value)
+        
+        for field, messages in zip(MESSAGE_FIELDS, message_lists):
+            session[field] = [orjson.loads(m) for m in messages]
+        
+        return session
+    
+    async def set(self, session_id: str, session: Dict, ttl_seconds: int):
+        """
+        Replace a whole session and reset its TTL
+        
+        Args:
+            session_id: Session identifier
+            session: Session data
+            ttl_seconds: Seconds of inactivity before the session expires
+        """
+        keys = self._keys(session_id)
+        
+        fields = {
+            name: orjson.dumps(value) for name, value in session.items()
+            if name != 'context' and name not in MESSAGE_FIELDS
+        }
+        fields.update(
+            (f"{CONTEXT_FIELD_PREFIX}{name}", orjson.dumps(value))
+            for name, value in session.get('context', {}).items()
+        )
+        
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(*keys)
+            pipe.hset(keys[0], mapping=fields)
+            for key, field in zip(keys[1:], MESSAGE_FIELDS):
+                if session.get(field):
+                    pipe.rpush(key, *(orjson.dumps(m) for m in session[field]))
+            for key in keys:
+                pipe.expire(key, ttl_seconds)
+            await pipe.execute()
+    
+    async def update(self, session_id: str, fields: Dict, ttl_seconds: int) -> bool:
+        """
+        Set top-level session fields, recording activity and resetting the TTL
+        
+        Args:
+            session_id: Session identifier
+            fields: Fields to set (none only refreshes the session)
+            ttl_seconds: Seconds of inactivity before the session expires
+        
+        Returns:
+            False if the session was not found
+        """
+        args = [ttl_seconds, orjson.dumps(time.time())]
+        for name, value in fields.items():
+            args += [name, orjson.dumps(value)]
+        
+        return bool(await self._update(keys=self._keys(session_id), args=args))
+    
+    async def set_context(self, session_id: str, key: str, value: Any, ttl_seconds: int) -> bool:
+        """
+        Set one session context entry, recording activity and resetting the TTL
+        
+        Args:
+            session_id: Session identifier
+            key: Context key
+            value: Context value
+            ttl_seconds: Seconds of inactivity before the session expires
+        
+        Returns:
+            False if the session was not found
+        """
+        args = [
+            ttl_seconds, orjson.dumps(time.time()),
+            f"{CONTEXT_FIELD_PREFIX}{key}", orjson.dumps(value)
+        ]
+        return bool(await self._update(keys=self._keys(session_id), args=args))
+    
+    async def append_message(self, session_id: str, field: str, message: Dict,
+                             max_length: int, ttl_seconds: int) -> bool:
+        """
+        Append a message to one of a session's message lists, recording
+        activity and resetting the TTL
+        
+        Args:
+            session_id: Session identifier
+            field: Message list ('conversation_history' or 'system_messages')
+            message: Message to append
+            max_length: Messages kept in the list, oldest dropped first (0 keeps all)
+            ttl_seconds: Seconds of inactivity before the session expires
+        
+        Returns:
+            False if the session was not found
+        """
+        # Lua lists are 1-based and KEYS[1] is the session hash
+        list_index = MESSAGE_FIELDS.index(field) + 2
+        args = [
+            ttl_seconds, orjson.dumps(time.time()), orjson.dumps(message),
+            list_index, max_length
+        ]
+        return bool(await self._append(keys=self._keys(session_id), args=args))
+    
+    async def delete(self, session_id: str):
+        """
+        Delete a session and its message lists
+        
+        Args:
+            session_id: Session identifier
+        """
+        await self.redis.delete(*self._keys(session_id))
+    
+    async def scan_expired(self) -> List[str]:
+        """
+        Nothing to sweep; Redis evicts sessions itself via EXPIRE
+        
+        Returns:
+            An empty list
+        """
+        return []
+    
+    async def count(self) -> int:
+        """
+        Count stored sessions by scanning their keys
+        
+        Returns:
+            Number of sessions
+        """
+        count = 0
+        # Only session hashes; message lists share the prefix
+        async for _ in self.redis.scan_iter(match=f"{self.KEY_PREFIX}*", _type="HASH"):
+            count += 1
+        return count
+    
+    async def aclose(self):
+        """
+        Close the Redis connection pool
+        """
+        await self.redis.aclose()
@@ -5,26 +5,155 @@ Handles video input, frame extraction, and preprocessing
 
 import cv2
 import numpy as np
-from typing import List, Tuple, Optional
+from typing import List, Tuple, Optional, Iterator, AsyncIterator
 import logging
 import os
-from PIL import Image
+import queue
+import asyncio
+import hashlib
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import base64
-from io import BytesIO
+
+from src._dedup_numba import dhash_batch
+
+try:
+    import av
+except ImportError:  # PyAV is optional; OpenCV decodes when it is missing
+    av = None
 
 logger = logging.getLogger(__name__)
 
+# Longest side, in pixels, of frames sent to the vision model
+MAX_FRAME_SIZE = 1024
+
+# Encoders by frame format: (extension, mime type, quality parameter, default quality)
+FRAME_FORMATS = {
+    'webp': ('.webp', 'image/webp', int(cv2.IMWRITE_WEBP_QUALITY), 80),
+    'jpeg': ('.jpg', 'image/jpeg', int(cv2.IMWRITE_JPEG_QUALITY), 85),
+}
+
+# Longest side and quality of the low-resolution copy of each frame
+THUMBNAIL_SIZE = 256
+THUMBNAIL_QUALITY = 70
+
+# Seconds a frame queue consumer waits before checking that the producer is still running
+FRAME_QUEUE_POLL_INTERVAL = 0.5
+
+# Targets closer than this many frames are reached by grabbing instead of seeking
+SEEK_MIN_GAP = 30
+
+# Allowed difference between the requested and reported position after a seek
+SEEK_TOLERANCE_FRAMES = 2
+
+# Encoding threads per processor; extraction already runs one processor per process
+DEFAULT_ENCODE_WORKERS = 2
+
 class VideoProcessor:
-    def __init__(self, max_frames: int = 30, max_duration: int = 120):
+    def __init__(self, max_frames: int = 30, max_duration: int = 120, pool_size: int = None,
+                 encode_workers: int = None, use_pyav: bool = None, fmt: str = 'webp',
+                 thumbnails: bool = False, dedup: bool = False):
         """
         Initialize video processor
         
         Args:
             max_frames: Maximum number of frames to extract
             max_duration: Maximum video duration in seconds
+            pool_size: Number of frame buffers kept for reuse (defaults to one per
+                encoder thread plus the one being decoded into)
+            encode_workers: Threads encoding frames while decoding continues
+                (defaults to DEFAULT_ENCODE_WORKERS)
+            use_pyav: Decode with PyAV, scaling frames during decode (defaults
+                to whether PyAV is installed)
+            fmt: Image format sent to the model ('webp' or 'jpeg'); WebP is about a
+                third smaller at the same quality
+            thumbnails: Also encode a low-resolution copy of each frame, for
+                batches sent as a key frame plus thumbnails
+            dedup: Also compute each frame's dHash, for near-duplicate skipping
         """
         self.max_frames = max_frames
         self.max_duration = max_duration
+        self.use_pyav = av is not None if use_pyav is None else use_pyav
+        
+        # Fall back to JPEG when this OpenCV build cannot encode WebP
+        if fmt not in FRAME_FORMATS:
+            raise ValueError(f"Unsupported frame format: {fmt}")
+        if fmt == 'webp' and not self._can_encode('webp'):
+            logger.warning("WebP encoding is unavailable, using JPEG")
+            fmt = 'jpeg'
+        self.fmt = fmt
+        self.thumbnails = thumbnails
+        self.dedup = dedup
+        self._extension, self.mime_type, self._quality_param, self.quality = FRAME_FORMATS[fmt]
+        
+        # resize/imencode release the GIL, so frames encode in parallel with decoding
+        self.encode_workers = encode_workers or DEFAULT_ENCODE_WORKERS
+        self._encoder = ThreadPoolExecutor(max_workers=self.encode_workers)
+        
+        # Decode buffers reused across sampled frames instead of allocating each one
+        self.pool_size = pool_size or self.encode_workers + 1
+        self._pool = queue.SimpleQueue()
+    
+    @contextmanager
+    def _open(self, video_path: str) -> Iterator[cv2.VideoCapture]:
+        """
+        Open a video capture that is released when the block exits, even on error
+        
+        Args:
+            video_path: Path to video file
+            
+        Yields:
+            Video capture
+        """
+        cap = cv2.VideoCapture(video_path)
+        try:
+            yield cap
+        finally:
+            cap.release()
+    
+    @staticmethod
+    def _can_encode(fmt: str) -> bool:
+        """
+        Check whether OpenCV can encode the given frame format
+        """
+        extension, _, quality_param, quality = FRAME_FORMATS[fmt]
+        try:
+            ok, _ = cv2.imencode(
+                extension, np.zeros((8, 8, 3), dtype=np.uint8), [quality_param, quality]
+            )
+            return ok
+        except cv2.error:
+            return False
+    
+    def _acquire_buffer(self, shape: Tuple[int, ...]) -> np.ndarray:
+        """
+        Take a frame buffer of the given shape from the pool, or allocate one
+        
+        Args:
+            shape: Frame shape (height, width, channels)
+            
+        Returns:
+            Writable uint8 frame buffer
+        """
+        try:
+            buffer = self._pool.get_nowait()
+            if buffer.shape == shape:
+                return buffer
+        except queue.Empty:
+            pass
+        
+        return np.empty(shape, dtype=np.uint8)
+    
+    def _release_buffer(self, buffer: np.ndarray):
+        """
+        Return a frame buffer to the pool once it is no longer used
+        
+        Args:
+            buffer: Frame buffer
+        """
+        if self._pool.qsize() < self.pool_size:
+            self._pool.put(buffer)
     
     def extract_frames(self, video_path: str) -> List[dict]:
         """
@@ -36,95 +165,304 @@ class VideoProcessor:
         Returns:
             List of frame data with timestamps
         """
-        frames_data = []
-        
         try:
-            # Open video
-            cap = cv2.VideoCapture(video_path)
+            frames_data = list(self.iter_frames(video_path))
             
-            # Get video properties
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            duration = total_frames / fps if fps > 0 else 0
+            logger.info(f"Extracted {len(frames_data)} frames from video")
+            return frames_data
             
-            # Validate duration
-            if duration > self.max_duration:
-                logger.warning(f"Video duration ({duration}s) exceeds maximum ({self.max_duration}s)")
-                duration = self.max_duration
-                total_frames = int(fps * self.max_duration)
+        except Exception as e:
+            logger.error(f"Error extracting frames: {str(e)}")
+            raise
+    
+    def iter_frames(self, video_path: str) -> Iterator[dict]:
+        """
+        Yield frames from video at regular intervals, one at a time
+        
+        Only the frame being processed is held in memory, so consumers
+        can start work before the whole video has been decoded.
+        
+        Args:
+            video_path: Path to video file
             
-            # Calculate frame interval
-            frame_interval = max(1, total_frames // self.max_frames)
+        Yields:
+            Frame data with timestamp
+        """
+        with self._open(video_path) as cap:
+            yield from self._iter_capture_frames(cap, video_path)
+    
+    def _iter_capture_frames(self, cap: cv2.VideoCapture, video_path: str) -> Iterator[dict]:
+        """
+        Yield frames at regular intervals from an opened capture
+        
+        Args:
+            cap: Opened video capture
+            video_path: Path to video file
             
-            logger.info(f"Processing video: {duration:.1f}s, {total_frames} frames, extracting every {frame_interval} frames")
+        Yields:
+            Frame data with timestamp
+        """
+        # Get video properties
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        duration = total_frames / fps if fps > 0 else 0
+        
+        # Validate duration
+        if duration > self.max_duration:
+            logger.warning(f"Video duration ({duration}s) exceeds maximum ({self.max_duration}s)")
+            duration = self.max_duration
+            total_frames = int(fps * self.max_duration)
+        
+        if total_frames <= 0:
+            logger.warning("Video reports no frames")
+            return
+        
+        # Sample frames evenly across the video
+        targets = np.unique(np.linspace(0, total_frames - 1, self.max_frames, dtype=int))
+        
+        logger.info(f"Processing video: {duration:.1f}s, {total_frames} frames, extracting {len(targets)} frames")
+        
+        # (frame data, encode future) in frame order
+        pending = deque()
+        frame_shape = (
+            int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            3
+        )
+        
+        if self.use_pyav:
+            decoded = self._decode_targets_av(video_path, targets, fps)
+        else:
+            decoded = self._decode_targets(cap, video_path, targets, frame_shape)
+        
+        for frame_number, frame in decoded:
+            timestamp = frame_number / fps if fps > 0 else 0
             
-            frame_count = 0
-            extracted_count = 0
+            # Encode on the thread pool; a pooled decode buffer goes back to the
+            # pool once its encode finishes, so it is never copied. PyAV allocates
+            # its own arrays, which are not pooled.
+            future = self._encoder.submit(self._encode_frame, frame)
+            if not self.use_pyav:
+                future.add_done_callback(lambda _, buffer=frame: self._release_buffer(buffer))
+            pending.append(({
+                'frame_number': frame_number,
+                'timestamp': timestamp,
+                'mime': self.mime_type,
+                'width': frame.shape[1],
+                'height': frame.shape[0]
+            }, future))
             
-            while cap.isOpened() and extracted_count < self.max_frames:
-                ret, frame = cap.read()
-                
-                if not ret:
-                    break
+            # Hand over finished frames in order; wait when the encoders are saturated
+            while pending and (pending[0][1].done() or len(pending) > self.encode_workers):
+                yield self._finish_frame(*pending.popleft())
+        
+        while pending:
+            yield self._finish_frame(*pending.popleft())
+    
+    def _decode_targets(self, cap: cv2.VideoCapture, video_path: str, targets: np.ndarray,
+                        frame_shape: Tuple[int, ...]) -> Iterator[Tuple[int, np.ndarray]]:
+        """
+        Decode the target frames, seeking over long gaps between them
+        
+        Falls back to grabbing every frame when the container reports an
+        inaccurate position after a seek.
+        
+        Args:
+            cap: Opened video capture
+            video_path: Path to video file, used to rewind the capture
+            targets: Increasing frame numbers to decode
+            frame_shape: Expected frame shape (height, width, channels)
+            
+        Yields:
+            tuple of (frame number, frame in a pooled buffer)
+        """
+        position = 0
+        can_seek = True
+        i = 0
+        
+        while i < len(targets):
+            target = int(targets[i])
+            
+            seeked = can_seek and target - position > SEEK_MIN_GAP
+            if seeked:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+                position = target
+            
+            # grab() advances without converting the frame to BGR;
+            # only targets pay for retrieve()
+            while position <= target:
+                if not cap.grab():
+                    return
+                position += 1
+            
+            if seeked and abs(cap.get(cv2.CAP_PROP_POS_FRAMES) - position) > SEEK_TOLERANCE_FRAMES:
+                logger.info("Seeking is inaccurate for this video, decoding sequentially")
+                can_seek = False
+                cap.open(video_path)
+                position = 0
+                continue
+            
+            # Decode into a pooled buffer; OpenCV allocates a new one if the
+            # decoded shape differs (e.g. rotated videos)
+            ret, frame = cap.retrieve(self._acquire_buffer(frame_shape))
+            
+            if not ret:
+                return
+            
+            frame_shape = frame.shape
+            yield target, frame
+            i += 1
+    
+    def _decode_targets_av(self, video_path: str, targets: np.ndarray,
+                           fps: float) -> Iterator[Tuple[int, np.ndarray]]:
+        """
+        Decode the target frames with PyAV, already scaled to the model's input size
+        
+        FFmpeg converts straight from the decoded picture to a downscaled BGR
+        frame, so full-resolution BGR frames are never materialized.
+        
+        Args:
+            video_path: Path to video file
+            targets: Increasing frame numbers to decode
+            fps: Frame rate used to map frame numbers to timestamps
+            
+        Yields:
+            tuple of (frame number, BGR frame)
+        """
+        with av.open(video_path) as container:
+            stream = container.streams.video[0]
+            stream.thread_type = 'AUTO'
+            
+            if fps <= 0:
+                fps = float(stream.average_rate or 0)
+            if fps <= 0:
+                raise ValueError("Cannot determine the video frame rate")
+            
+            width, height = stream.codec_context.width, stream.codec_context.height
+            scale = min(1, MAX_FRAME_SIZE / max(width, height))
+            target_width, target_height = round(width * scale), round(height * scale)
+            
+            start_pts = stream.start_time or 0
+            decoded = container.decode(stream)
+            # Number of the next frame the decoder will return
+            position = 0
+            
+            for target in targets:
+                target = int(target)
                 
-                # Extract frame at interval
-                if frame_count % frame_interval == 0:
-                    timestamp = frame_count / fps if fps > 0 else 0
-                    
-                    # Convert frame to base64 for processing
-                    frame_base64 = self._frame_to_base64(frame)
-                    
-                    frames_data.append({
-                        'frame_number': frame_count,
-                        'timestamp': timestamp,
-                        'image': frame_base64,
-                        'width': frame.shape[1],
-                        'height': frame.shape[0]
-                    })
-                    
-                    extracted_count += 1
+                # Seek to the keyframe before the target and decode forward from there
+                if target - position > SEEK_MIN_GAP:
+                    container.seek(start_pts + int(target / fps / stream.time_base), stream=stream)
+                    decoded = container.decode(stream)
                 
-                frame_count += 1
+                for frame in decoded:
+                    if frame.pts is None:
+                        continue
+                    position = round((frame.pts - start_pts) * stream.time_base * fps) + 1
+                    if position > target:
+                        break
+                else:
+                    return
                 
-                # Stop if we've processed enough of the video
-                if frame_count >= total_frames:
-                    break
-            
-            cap.release()
+                image = frame.reformat(width=target_width, height=target_height, format='bgr24')
+                yield target, image.to_ndarray()
+    
+    def _encode_frame(self, frame: np.ndarray) -> dict:
+        """
+        Encode a frame and, when enabled, its thumbnail and dHash
+        
+        The hashes let the recognizer reuse cached results and skip near-duplicates.
+        
+        Args:
+            frame: OpenCV frame (BGR format)
             
-            logger.info(f"Extracted {len(frames_data)} frames from video")
-            return frames_data
+        Returns:
+            Dictionary with base64 image, content hash, and optional dHash and
+            base64 thumbnail
+        """
+        frame_base64, content_hash = self._frame_to_base64(frame)
+        
+        frame_data = {
+            'image': frame_base64,
+            'hash': content_hash
+        }
+        
+        if self.dedup:
+            frame_data['dhash'] = self._frame_dhash(frame)
+        
+        if self.thumbnails:
+            frame_data['thumbnail'], _ = self._frame_to_base64(
+                frame, THUMBNAIL_SIZE, THUMBNAIL_QUALITY
+            )
+        
+        return frame_data
+    
+    def _finish_frame(self, frame_data: dict, future) -> dict:
+        """
+        Attach the result of a frame's encode to its frame data
+        
+        Args:
+            frame_data: Frame data with timestamp
+            future: Future returned by submitting _encode_frame
             
-        except Exception as e:
-            logger.error(f"Error extracting frames: {str(e)}")
-            raise
+        Returns:
+            Frame data with base64 image, thumbnail and hashes
+        """
+        frame_data.update(future.result())
+        return frame_data
     
-    def _frame_to_base64(self, frame: np.ndarray) -> str:
+    def _frame_to_base64(self, frame: np.ndarray, max_size: int = MAX_FRAME_SIZE,
+                         quality: int = None) -> Tuple[str, str]:
         """
         Convert OpenCV frame to base64 string
         
         Args:
             frame: OpenCV frame (BGR format)
+            max_size: Longest side of the encoded image
+            quality: Encoder quality (defaults to the format's quality)
             
         Returns:
-            Base64 encoded image string
+            tuple of (base64 encoded image string, SHA-256 hex digest of the encoded bytes)
         """
-        # Convert BGR to RGB
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        # Resize if too large (for API limits), keeping the aspect ratio
+        height, width = frame.shape[:2]
+        scale = max_size / max(height, width)
+        if scale < 1:
+            frame = cv2.resize(
+                frame, (round(width * scale), round(height * scale)),
+                interpolation=cv2.INTER_AREA
+            )
+        
+        # Encode straight from BGR; OpenCV handles the channel order
+        ok, buffer = cv2.imencode(
+            self._extension, frame, [self._quality_param, quality or self.quality]
+        )
+        if not ok:
+            raise ValueError(f"Failed to encode frame as {self.fmt}")
         
-        # Convert to PIL Image
-        pil_image = Image.fromarray(rgb_frame)
+        image_bytes = buffer.tobytes()
+        img_base64 = base64.b64encode(image_bytes).decode('ascii')
         
-        # Resize if too large (for API limits)
-        max_size = (1024, 1024)
-        pil_image.thumbnail(max_size, Image.Resampling.LANCZOS)
+        return img_base64, hashlib.sha256(image_bytes).hexdigest()
+    
+    def _frame_dhash(self, frame: np.ndarray) -> int:
+        """
+        Compute a 64-bit difference hash of a frame
+        
+        Visually similar frames have hashes a small Hamming distance apart.
         
-        # Convert to base64
-        buffered = BytesIO()
-        pil_image.save(buffered, format="JPEG", quality=85)
-        img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+        Args:
+            frame: OpenCV frame (BGR format)
+            
+        Returns:
+            64-bit dHash
+        """
+        # Shrink before converting so only 72 pixels go through cvtColor
+        small = cv2.resize(frame, (9, 8), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
         
-        return img_base64
+        # Frames stream through the encoder threads one at a time, so the batch is one
+        return int(dhash_batch(gray[np.newaxis])[0])
     
     def validate_video(self, video_path: str) -> tuple[bool, str]:
         """
@@ -140,28 +478,38 @@ class VideoProcessor:
             if not os.path.exists(video_path):
                 return False, "Video file not found"
             
-            cap = cv2.VideoCapture(video_path)
-            
-            if not cap.isOpened():
-                return False, "Cannot open video file"
-            
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            
-            if total_frames == 0:
-                return False, "Video has no frames"
-            
-            duration = total_frames / fps if fps > 0 else 0
-            
-            if duration > self.max_duration:
-                return False, f"Video duration ({duration:.1f}s) exceeds maximum ({self.max_duration}s)"
-            
-            cap.release()
-            return True, "Video is valid"
+            with self._open(video_path) as cap:
+                return self._validate_capture(cap)
             
         except Exception as e:
             return False, f"Error validating video: {str(e)}"
     
+    def _validate_capture(self, cap: cv2.VideoCapture) -> tuple[bool, str]:
+        """
+        Validate an opened video capture
+        
+        Args:
+            cap: Video capture
+            
+        Returns:
+            tuple of (is_valid, error_message)
+        """
+        if not cap.isOpened():
+            return False, "Cannot open video file"
+        
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        
+        if total_frames == 0:
+            return False, "Video has no frames"
+        
+        duration = total_frames / fps if fps > 0 else 0
+        
+        if duration > self.max_duration:
+            return False, f"Video duration ({duration:.1f}s) exceeds maximum ({self.max_duration}s)"
+        
+        return True, "Video is valid"
+    
     def get_video_info(self, video_path: str) -> dict:
         """
         Get video metadata
@@ -173,22 +521,151 @@ class VideoProcessor:
             Dictionary with video information
         """
         try:
-            cap = cv2.VideoCapture(video_path)
-            
-            info = {
-                'fps': cap.get(cv2.CAP_PROP_FPS),
-                'frame_count': int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
-                'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
-                'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
-                'duration': 0
-            }
-            
-            if info['fps'] > 0:
-                info['duration'] = info['frame_count'] / info['fps']
-            
-            cap.release()
-            return info
+            with self._open(video_path) as cap:
+                return self._capture_info(cap)
             
         except Exception as e:
             logger.error(f"Error getting video info: {str(e)}")
             return {}
+    
+    def _capture_info(self, cap: cv2.VideoCapture) -> dict:
+        """
+        Read metadata from an opened video capture
+        
+        Args:
+            cap: Video capture
+            
+        Returns:
+            Dictionary with video information
+        """
+        info = {
+            'fps': cap.get(cv2.CAP_PROP_FPS),
+            'frame_count': int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+            'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            'duration': 0
+        }
+        
+        if info['fps'] > 0:
+            info['duration'] = info['frame_count'] / info['fps']
+        
+        return info
+    
+    def process(self, video_path: str) -> Tuple[dict, List[dict]]:
+        """
+        Read metadata, validate and extract frames through one OpenCV capture
+        
+        When decoding with PyAV, the capture still supplies the metadata and
+        PyAV opens the file a second time to decode frames.
+        
+        Args:
+            video_path: Path to video file
+            
+        Returns:
+            tuple of (video information, list of frame data with timestamps)
+            
+        Raises:
+            ValueError: If the video is missing or invalid
+        """
+        if not os.path.exists(video_path):
+            raise ValueError("Video file not found")
+        
+        with self._open(video_path) as cap:
+            info = self._capture_info(cap)
+            
+            is_valid, message = self._validate_capture(cap)
+            if not is_valid:
+                raise ValueError(message)
+            
+            frames_data = list(self._iter_capture_frames(cap, video_path))
+        
+        logger.info(f"Extracted {len(frames_data)} frames from video")
+        return info, frames_data
+
+# Per-process instance used by ProcessPoolExecutor workers
+_worker_processor: Optional[VideoProcessor] = None
+
+def init_worker(max_frames: int = 30, max_duration: int = 120, fmt: str = 'webp',
+                thumbnails: bool = False, dedup: bool = False):
+    """
+    Create the VideoProcessor for a worker process
+    
+    Args:
+        max_frames: Maximum number of frames to extract
+        max_duration: Maximum video duration in seconds
+        fmt: Image format sent to the model ('webp' or 'jpeg')
+        thumbnails: Also encode a low-resolution copy of each frame
+        dedup: Also compute each frame's dHash
+    """
+    global _worker_processor
+    _worker_processor = VideoProcessor(
+        max_frames, max_duration, fmt=fmt, thumbnails=thumbnails, dedup=dedup
+    )
+
+def reencode_as_jpeg(frame: dict):
+    """
+    Re-encode a frame's image and thumbnail as JPEG in place, for endpoints
+    that reject their format
+    
+    Args:
+        frame: Frame data with base64 image, thumbnail and mime type
+    """
+    extension, mime_type, quality_param, quality = FRAME_FORMATS['jpeg']
+    
+    for key, key_quality in (('image', quality), ('thumbnail', THUMBNAIL_QUALITY)):
+        if key not in frame:
+            continue
+        
+        image = cv2.imdecode(
+            np.frombuffer(base64.b64decode(frame[key]), dtype=np.uint8), cv2.IMREAD_COLOR
+        )
+        ok, buffer = cv2.imencode(extension, image, [quality_param, key_quality])
+        if not ok:
+            raise ValueError("Failed to encode frame as jpeg")
+        
+        frame[key] = base64.b64encode(buffer.tobytes()).decode('ascii')
+    
+    frame['mime'] = mime_type
+    # Any uploaded copy is in the old format
+    frame.pop('url', None)
+
+def stream_frames_in_worker(video_path: str, frame_queue):
+    """
+    Extract frames using the worker process's VideoProcessor, publishing
+    each one as soon as it is encoded
+    
+    Args:
+        video_path: Path to video file
+        frame_queue: Shared queue receiving frame data, then None when done
+    """
+    try:
+        for frame in _worker_processor.iter_frames(video_path):
+            frame_queue.put(frame)
+    finally:
+        frame_queue.put(None)
+
+async def aiter_frame_queue(frame_queue, producer: Optional[asyncio.Future] = None) -> AsyncIterator[dict]:
+    """
+    Iterate frames published by stream_frames_in_worker without blocking the event loop
+    
+    Args:
+        frame_queue: Shared queue passed to stream_frames_in_worker
+        producer: Future of the stream_frames_in_worker call; iteration stops once
+            it has finished and the queue is empty, even if the sentinel never arrives
+        
+    Yields:
+        Frame data with timestamp
+    """
+    while True:
+        # Checked before waiting, so a timeout afterwards means nothing is left to read
+        finished = producer is not None and producer.done()
+        try:
+            # Bounded waits so a dead producer never pins an executor thread
+            frame = await asyncio.to_thread(frame_queue.get, timeout=FRAME_QUEUE_POLL_INTERVAL)
+        except queue.Empty:
+            if finished:
+                return
+            continue
+        if frame is None:
+            return
+        yield frame